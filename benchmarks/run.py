@@ -0,0 +1,337 @@
+"""Offline benchmarks for ingestion, retrieval and prompt assembly.
+
+Runs against synthetic corpora with a stub embedding model and a stubbed
+DeepSeek, so no network, GPU or Ollama is needed:
+
+    python benchmarks/run.py                          # 1k, 10k and 100k chunks
+    python benchmarks/run.py --sizes 1000 1000000     # any sizes
+    python benchmarks/run.py --compare <commit>       # diff against an earlier run
+    python benchmarks/run.py --quantization sq8       # quantized index + rescoring
+
+Each size runs in its own process so peak memory is per size, and startup is
+timed in a fresh process against the store that was just built, both after
+an explicit compaction and as ingestion left it. Results are
+written to benchmarks/results/<commit>.json (<commit>-<quantization>.json).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+VOCABULARY = 20_000
+WORDS_PER_CHUNK = (40, 120)
+CHUNKS_PER_SOURCE = 1_000
+MAX_SOURCES = 100
+ALLOWED_FRACTION = 0.1  # share of sources selected for the allowed_sources runs
+N_QUERIES = 200
+N_TURNS = 50
+SEED = 0
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StubModel:
+    """Stands in for SentenceTransformer: deterministic unit vectors from a text hash."""
+
+    dim = 384
+    tokenizer = None  # the chunker falls back to approximate token counts
+
+    def __init__(self):
+        rng = np.random.default_rng(SEED)
+        self.basis = rng.standard_normal((4096, self.dim)).astype("float32")
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, **kwargs):
+        h = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in texts), dtype="int64", count=len(texts))
+        vectors = self.basis[h % 4096] + 0.5 * self.basis[(h >> 12) % 4096]
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def stub_stream(prompt, *args, **kwargs):
+    yield "<think>stub reasoning</think>"
+    yield "Stub answer built from the retrieved context."
+
+
+def install_stubs():
+    import ollama_chat
+    import vector_store
+    vector_store._models[(vector_store.MODEL_NAME, "torch")] = StubModel()
+    # cached_stream looks stream_deepseek up at call time
+    ollama_chat.stream_deepseek = stub_stream
+
+
+def make_words():
+    rng = np.random.default_rng(SEED)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    return ["".join(rng.choice(letters, rng.integers(3, 10))) for _ in range(VOCABULARY)]
+
+
+def make_corpus(n, words, seed=SEED):
+    """n chunk texts with Zipf-distributed words, yielded in source-sized groups."""
+    rng = np.random.default_rng(seed)
+    words = np.array(words, dtype=object)
+    for start in range(0, n, CHUNKS_PER_SOURCE):
+        size = min(CHUNKS_PER_SOURCE, n - start)
+        lengths = rng.integers(*WORDS_PER_CHUNK, size=size)
+        ids = np.minimum(rng.zipf(1.2, size=lengths.sum()), VOCABULARY) - 1
+        texts = [" ".join(chunk) + "." for chunk in np.split(words[ids], np.cumsum(lengths)[:-1])]
+        yield f"source-{start // CHUNKS_PER_SOURCE:05d}", texts
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 3), "p99_ms": round(float(np.percentile(ms, 99)), 3)}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def disk_mb(directory):
+    total = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(directory) for f in files)
+    return round(total / 2**20, 1)
+
+
+def time_queries(vs, queries, **kwargs):
+    samples = []
+    for q in queries:
+        t = time.perf_counter()
+        vs.query(q, k=7, **kwargs)
+        samples.append(time.perf_counter() - t)
+    return percentiles(samples)
+
+
+def bench_chunker(texts):
+    from chunker import get_chunker
+    pages = [" ".join(texts[i:i + 20]) for i in range(0, len(texts), 20)]
+    size = sum(len(p) for p in pages)
+    t = time.perf_counter()
+    n = sum(1 for _ in get_chunker("pdf").chunks(pages))
+    elapsed = time.perf_counter() - t
+    return {"chunks_per_s": round(n / elapsed), "mb_per_s": round(size / 2**20 / elapsed, 2)}
+
+
+def bench_ingest_pages(texts):
+    """Ingest through ingest.ingest_pages (chunker -> prefetch -> add_texts) into a fresh store."""
+    from ingest import ingest_pages
+    from vector_store import VectorStore
+    directory = tempfile.mkdtemp(prefix="smartbuddy-bench-pages-")
+    try:
+        vs = VectorStore(directory, index_type="flat")
+        pages = [" ".join(texts[i:i + 20]) for i in range(0, len(texts), 20)]
+        t = time.perf_counter()
+        n = ingest_pages(vs, pages, "pages", "pdf")
+        elapsed = time.perf_counter() - t
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"pages_per_s": round(len(pages) / elapsed), "chunks_per_s": round(n / elapsed)}
+
+
+def bench_html(texts):
+    from loader import html_to_text
+    body = "".join(f"<p>{t}</p>" for t in texts)
+    page = f"<html><head><script>var x = 1;</script></head><body><nav>Home</nav><article>{body}</article></body></html>"
+    t = time.perf_counter()
+    html_to_text(page)
+    return {"mb_per_s": round(len(page) / 2**20 / (time.perf_counter() - t), 2)}
+
+
+def run_size(n, workdir, quantization=None, snapshot=None):
+    """Build a store of n chunks in workdir and measure it; returns a result dict.
+
+    snapshot, if given, gets a copy of the store as ingestion left it (WAL not
+    folded in by an explicit compaction), for timing startup in that state too.
+    """
+    os.chdir(workdir)  # embedding and response caches live in the working directory
+    install_stubs()
+    from ollama_chat import call_deepseek
+    from prompting import ConversationMemory, build_chat_prompt
+    from index_backends import choose_kind, can_build
+    from vector_store import VectorStore
+
+    words = make_words()
+    result = {"chunks": n}
+    # no background migrations while ingesting
+    vs = VectorStore(index_type="flat", quantization=quantization)
+
+    sample = []
+    t = time.perf_counter()
+    for source, texts in make_corpus(n, words):
+        vs.add_texts(texts, source)
+        if len(sample) < 5_000:
+            sample.extend(texts[:5_000 - len(sample)])
+    elapsed = time.perf_counter() - t
+    result["ingest"] = {"seconds": round(elapsed, 3), "chunks_per_s": round(n / elapsed)}
+    while vs.busy:
+        time.sleep(0.05)  # let a background compaction finish before copying
+    result["ingest"]["wal_rows"] = vs.index.ntotal - vs._base_rows
+    if snapshot:
+        shutil.copytree(workdir, snapshot)
+
+    kind = choose_kind(n)
+    if not can_build(kind, vs.index.ntotal):
+        kind = "flat"
+    quantization = vs._target_quantization(kind, vs.index.ntotal)
+    t = time.perf_counter()
+    if (kind, quantization) == ("flat", None):
+        vs.compact()
+    else:
+        vs.migrate(kind, quantization)  # trains, swaps and compacts
+    result["index_build"] = {"kind": kind, "quantization": quantization,
+                             "seconds": round(time.perf_counter() - t, 3)}
+    vs.index_type = "auto"
+
+    rng = np.random.default_rng(SEED + 1)
+    queries = [" ".join(rng.choice(words[:2_000], 3)) for _ in range(N_QUERIES)]
+    sources = list(vs.source_rows)
+    allowed = sources[:max(1, int(len(sources) * ALLOWED_FRACTION))]
+    result["query"] = {
+        mode: {"all": time_queries(vs, queries, mode=mode),
+               "allowed_sources": time_queries(vs, queries, mode=mode, allowed_sources=allowed)}
+        for mode in ("dense", "hybrid")
+    }
+
+    # One chat turn, as main.py runs it: retrieve, assemble the prompt with the
+    # conversation so far, answer (stubbed LLM, response cache miss)
+    samples = []
+    memory = ConversationMemory()
+    for q in queries[:N_TURNS]:
+        t = time.perf_counter()
+        memory.add("user", q)
+        chunks = vs.query(q, k=7, mode="hybrid")
+        prompt, ids = build_chat_prompt(q, chunks, memory)
+        memory.add("assistant", call_deepseek(prompt, ids)["full"])
+        samples.append(time.perf_counter() - t)
+    result["chat_turn"] = percentiles(samples)
+
+    result["chunker"] = bench_chunker(sample)
+    result["ingest_pages"] = bench_ingest_pages(sample)
+    result["html_to_text"] = bench_html(sample[:2_000])
+    result["memory"] = {"peak_rss_mb": peak_rss_mb(), "disk_mb": disk_mb(workdir)}
+    return result
+
+
+def run_startup(workdir, query, quantization=None):
+    """Time opening an existing store in a fresh process up to its first answered query."""
+    t = time.perf_counter()
+    os.chdir(workdir)
+    install_stubs()
+    from vector_store import VectorStore
+    vs = VectorStore(quantization=quantization)
+    opened = time.perf_counter() - t
+    vs.query(query, k=7, mode="hybrid")
+    return {"open_s": round(opened, 3), "first_query_s": round(time.perf_counter() - t, 3),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def run_child(*args):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), *args],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    if git("status", "--porcelain", "--untracked-files=no"):
+        commit += "-dirty"
+    return commit
+
+
+def compare(current, other_commit):
+    with open(os.path.join(RESULTS_DIR, f"{other_commit}.json"), encoding="utf-8") as f:
+        other = {r["chunks"]: r for r in json.load(f)["results"]}
+
+    def flatten(d, prefix=""):
+        for k, v in d.items():
+            if isinstance(v, dict):
+                yield from flatten(v, f"{prefix}{k}.")
+            elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                yield f"{prefix}{k}", v
+
+    print(f"\n{'metric':<45}{other_commit:>14}{'now':>14}{'change':>10}")
+    for result in current:
+        if result["chunks"] not in other:
+            continue
+        before = dict(flatten(other[result["chunks"]]))
+        print(f"--- {result['chunks']:,} chunks")
+        for metric, value in flatten(result):
+            if metric in before and metric != "chunks" and before[metric]:
+                change = (value - before[metric]) / before[metric] * 100
+                print(f"{metric:<45}{before[metric]:>14}{value:>14}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SmartBuddy benchmarks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="corpus sizes in chunks")
+    parser.add_argument("--compare", metavar="COMMIT", help="compare with benchmarks/results/COMMIT.json")
+    parser.add_argument("--keep", action="store_true", help="keep the generated stores")
+    parser.add_argument("--quantization", choices=("fp16", "sq8"), help="store vectors at reduced precision")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--startup", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--snapshot", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        print(json.dumps(run_size(args.one, args.workdir, args.quantization, args.snapshot)))
+        return
+    if args.startup:
+        print(json.dumps(run_startup(args.workdir, args.startup, args.quantization)))
+        return
+
+    extra = ["--quantization", args.quantization] if args.quantization else []
+    results = []
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f"smartbuddy-bench-{n}-")
+        snapshot = workdir + "-uncompacted"
+        try:
+            print(f"Benchmarking {n:,} chunks...", file=sys.stderr)
+            result = run_child("--one", str(n), "--workdir", workdir, "--snapshot", snapshot, *extra)
+            result["startup"] = run_child("--startup", "benchmark startup query", "--workdir", workdir, *extra)
+            # The same store as ingestion left it, before the explicit compact / migrate
+            result["startup_uncompacted"] = run_child("--startup", "benchmark startup query",
+                                                      "--workdir", snapshot, *extra)
+            results.append(result)
+            print(json.dumps(result, indent=2), file=sys.stderr)
+        finally:
+            if args.keep:
+                print(f"Stores kept in {workdir} and {snapshot}", file=sys.stderr)
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+                shutil.rmtree(snapshot, ignore_errors=True)
+
+    commit = git_commit() + (f"-{args.quantization}" if args.quantization else "")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(), "platform": platform.platform(),
+                   "cpus": os.cpu_count(), "results": results}, f, indent=2)
+    print(f"Results written to {path}", file=sys.stderr)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
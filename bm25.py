@@ -0,0 +1,114 @@
+import math
+import os
+import pickle
+import re
+from array import array
+from collections import Counter
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Incremental inverted index scored with Okapi BM25.
+
+    Postings are compact arrays of (row, term frequency) per term, so a lookup
+    only touches the rows that contain the query terms.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> (array of rows, array of term frequencies)
+        self.doc_len = array("I")  # tokens per row
+        self.total_len = 0
+
+    @property
+    def n_rows(self):
+        return len(self.doc_len)
+
+    def add(self, texts):
+        """Index texts as the next rows."""
+        for text in texts:
+            row = len(self.doc_len)
+            tokens = tokenize(text)
+            for term, tf in Counter(tokens).items():
+                if term not in self.postings:
+                    self.postings[term] = (array("I"), array("I"))
+                rows, tfs = self.postings[term]
+                rows.append(row)
+                tfs.append(tf)
+            self.doc_len.append(len(tokens))
+            self.total_len += len(tokens)
+
+    def sync(self, chunks, n):
+        """Catch up with rows [n_rows, n) of a ChunkStore."""
+        if self.n_rows < n:
+            self.add(chunks.get(row)['chunk'] for row in range(self.n_rows, n))
+
+    def search(self, query, k, allowed_rows=None, excluded_rows=None):
+        """Top-k (rows, scores) for query, optionally restricted to a sorted array of rows
+        (allowed_rows) or to every row but a sorted array of rows (excluded_rows)."""
+        if not self.n_rows:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        avg_len = self.total_len / self.n_rows
+        doc_len = np.frombuffer(self.doc_len, dtype="uint32")
+        hit_rows, hit_scores = [], []
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, tfs = self.postings[term]
+            rows = np.frombuffer(rows, dtype="uint32").astype("int64")
+            tfs = np.frombuffer(tfs, dtype="uint32").astype("float32")
+            idf = math.log(1 + (self.n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_len[rows] / avg_len)
+            hit_rows.append(rows)
+            hit_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not hit_rows:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        rows, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores)).astype("float32")
+        if allowed_rows is not None:
+            keep = np.isin(rows, allowed_rows, assume_unique=True)
+            rows, scores = rows[keep], scores[keep]
+        if excluded_rows is not None and len(excluded_rows):
+            keep = ~np.isin(rows, excluded_rows, assume_unique=True)
+            rows, scores = rows[keep], scores[keep]
+        if len(rows) > k:
+            top = np.argpartition(-scores, k)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((self.k1, self.b, self.postings, self.doc_len, self.total_len), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                index.k1, index.b, index.postings, index.doc_len, index.total_len = pickle.load(f)
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k, c=60):
+    """Fuse several ranked row arrays; a row scores sum(1 / (c + rank)) over the lists it's in."""
+    rankings = [np.asarray(r, dtype="int64") for r in rankings]
+    rows = np.concatenate(rankings)
+    if not len(rows):
+        return rows
+    weights = np.concatenate([1.0 / (c + np.arange(1, len(r) + 1)) for r in rankings])
+    unique, inverse = np.unique(rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=weights)
+    return unique[np.argsort(-scores, kind="stable")[:k]]
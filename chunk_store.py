@@ -0,0 +1,276 @@
+import hashlib
+import mmap
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# One fixed-size record per chunk: where its text lives in chunks.txt and
+# which interned source it belongs to
+ROW = np.dtype([("offset", "<u8"), ("length", "<u4"), ("source", "<u4")])
+# An extra source that shares an existing row instead of storing a duplicate
+LINK = np.dtype([("row", "<u8"), ("source", "<u4")])
+# A deleted source: its own rows below `rows` and its links below `links` no longer count
+DELETION = np.dtype([("source", "<u4"), ("rows", "<u8"), ("links", "<u8")])
+
+
+def chunk_hash(text):
+    """64-bit content hash used to spot identical chunks inside a store."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _map(path, dtype, size):
+    n = size // dtype.itemsize
+    return np.memmap(path, dtype=dtype, mode="r", shape=(n,)) if n else np.empty(0, dtype=dtype)
+
+
+def _fsync_write(f, data):
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class WriteLock:
+    """Exclusive lock on a store directory's .write.lock file, held across processes.
+
+    Re-entrant for the thread holding it. Every writer (the app, CLI ingests,
+    queue workers) takes it around reload -> append -> WAL, so two processes
+    never write rows, sources or log records from stale counts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            f = open(self.path, "a+b")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                else:
+                    f.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:  # LK_LOCK gives up after ~10 seconds
+                            continue
+            except BaseException:
+                f.close()
+                self._lock.release()
+                raise
+            self._file = f
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+class ChunkStore:
+    """Append-only chunk texts and metadata, memory-mapped for reads.
+
+    chunks.txt holds every chunk's UTF-8 text back to back, chunks.rows one
+    ROW record per chunk, chunks.hash its 64-bit content hash, chunks.links
+    extra sources attached to existing rows, chunks.deleted tombstones for
+    deleted sources and sources.txt one source id per line (its line number
+    is the interned integer id). Nothing is loaded into the heap except the
+    source table; chunks are decoded on demand.
+    """
+
+    FILES = ("chunks.txt", "chunks.rows", "chunks.hash", "chunks.links", "chunks.deleted", "sources.txt")
+
+    def __init__(self, directory="."):
+        self.text_file = os.path.join(directory, "chunks.txt")
+        self.rows_file = os.path.join(directory, "chunks.rows")
+        self.hash_file = os.path.join(directory, "chunks.hash")
+        self.links_file = os.path.join(directory, "chunks.links")
+        self.deleted_file = os.path.join(directory, "chunks.deleted")
+        self.sources_file = os.path.join(directory, "sources.txt")
+        self.sources = []
+        self.source_ids = {}
+        self.rows = np.empty(0, dtype=ROW)
+        self.hashes = np.empty(0, dtype="<u8")
+        self.links = np.empty(0, dtype=LINK)
+        self.deleted = np.empty(0, dtype=DELETION)
+        self._blob = b""
+        self._sizes = (0, 0, 0, 0, 0, 0)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def refresh(self):
+        """Remap the files if they grew since the last refresh (here or in another process)."""
+        files = (self.rows_file, self.text_file, self.sources_file, self.hash_file, self.links_file,
+                 self.deleted_file)
+        sizes = tuple(_size(path) for path in files)
+        if sizes == self._sizes:
+            return
+        rows_size, text_size, sources_size, hash_size, links_size, deleted_size = sizes
+        # A torn trailing record is ignored and overwritten by the next append
+        self.rows = _map(self.rows_file, ROW, rows_size)
+        self.hashes = _map(self.hash_file, np.dtype("<u8"), hash_size)
+        self.links = _map(self.links_file, LINK, links_size)
+        self.deleted = _map(self.deleted_file, DELETION, deleted_size)
+        if text_size:
+            with open(self.text_file, "rb") as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if sources_size != self._sizes[2]:
+            with open(self.sources_file, encoding="utf-8") as f:
+                self.sources = f.read().splitlines()
+            self.source_ids = {s: i for i, s in enumerate(self.sources)}
+        self._sizes = sizes
+
+    def get(self, row):
+        r = self.rows[row]
+        offset = int(r["offset"])
+        text = self._blob[offset:offset + int(r["length"])].decode("utf-8")
+        return {'chunk': text, 'source': self.sources[r["source"]], 'id': int(row)}
+
+    def source_rows(self, n):
+        """Group rows [0, n) by live source: {source: int64 array of rows}."""
+        own = np.asarray(self.rows["source"][:n])
+        links = np.asarray(self.links)
+        keep_own = np.ones(len(own), dtype=bool)
+        keep_links = links["row"] < n
+        for d in np.asarray(self.deleted):
+            keep_own[:d["rows"]] &= own[:d["rows"]] != d["source"]
+            keep_links[:d["links"]] &= links["source"][:d["links"]] != d["source"]
+        links = links[keep_links]
+        sources = np.concatenate([own[keep_own], links["source"]])
+        rows = np.concatenate([np.flatnonzero(keep_own), links["row"].astype("int64")])
+        order = np.argsort(sources, kind="stable")
+        ids, starts = np.unique(sources[order], return_index=True)
+        groups = np.split(rows[order], starts[1:])
+        return {self.sources[i]: rows for i, rows in zip(ids, groups)}
+
+    def _intern(self, source):
+        self.refresh()  # another writer may have interned sources since (callers hold the WriteLock)
+        if source not in self.source_ids:
+            with open(self.sources_file, "a", encoding="utf-8") as f:
+                _fsync_write(f, source + "\n")
+            self.source_ids[source] = len(self.sources)
+            self.sources.append(source)
+        return self.source_ids[source]
+
+    def _write_at(self, path, data, position):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        with os.fdopen(fd, "r+b") as f:
+            f.seek(position)
+            _fsync_write(f, data)
+
+    def append(self, texts, source, start, hashes):
+        """Store texts (with their content hashes) for `source` as rows start, start+1, ...
+
+        Rows at or past `start` left over from an interrupted write are
+        overwritten, so callers pass the row count they consider committed.
+        """
+        data = [t.encode("utf-8") for t in texts]
+        sid = self._intern(source)
+        with open(self.text_file, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            _fsync_write(f, b"".join(data))
+
+        lengths = np.fromiter((len(d) for d in data), dtype="<u8", count=len(data))
+        rows = np.empty(len(data), dtype=ROW)
+        rows["offset"] = offset + np.cumsum(lengths) - lengths
+        rows["length"] = lengths
+        rows["source"] = sid
+        self._write_at(self.hash_file, np.asarray(hashes, dtype="<u8").tobytes(), start * 8)
+        self._write_at(self.rows_file, rows.tobytes(), start * ROW.itemsize)
+        self.refresh()
+
+    def backfill_hashes(self, n):
+        """Hash rows [len(hashes), n) for stores written before chunks.hash existed."""
+        start = len(self.hashes)
+        if start >= n:
+            return
+        hashes = np.array([chunk_hash(self.get(row)['chunk']) for row in range(start, n)], dtype="<u8")
+        self._write_at(self.hash_file, hashes.tobytes(), start * 8)
+        self.refresh()
+
+    def delete_source(self, source, n):
+        """Tombstone everything `source` holds among rows [0, n) and the links made so far."""
+        if source not in self.source_ids:
+            return
+        record = np.array([(self.source_ids[source], n, len(self.links))], dtype=DELETION)
+        self._write_at(self.deleted_file, record.tobytes(), len(self.deleted) * DELETION.itemsize)
+        self.refresh()
+
+    def link(self, rows, source):
+        """Record that `source` also contains the (already stored) chunks at rows."""
+        links = np.empty(len(rows), dtype=LINK)
+        links["row"] = rows
+        links["source"] = self._intern(source)
+        self._write_at(self.links_file, links.tobytes(), len(self.links) * LINK.itemsize)
+        self.refresh()
+
+
+class VectorFile:
+    """Append-only float16 copy of every row's embedding, memory-mapped for reads.
+
+    Used to rescore candidates from a quantized index with near-exact vectors;
+    only the rows being rescored are ever paged in.
+    """
+
+    def __init__(self, path, dim=384):
+        self.path = path
+        self.dtype = np.dtype(("<f2", (dim,)))
+        self._size = -1
+        self.refresh()
+
+    def __len__(self):
+        return len(self.data)
+
+    def refresh(self):
+        size = _size(self.path)
+        if size != self._size:
+            self.data = _map(self.path, self.dtype, size)
+            self._size = size
+
+    def write(self, start, vectors):
+        """Store vectors as rows start, start+1, ... (overwriting rows left by an interrupted write)."""
+        data = np.ascontiguousarray(vectors, dtype="<f2").tobytes()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        with os.fdopen(fd, "r+b") as f:
+            f.seek(start * self.dtype.itemsize)
+            _fsync_write(f, data)
+        self.refresh()
+
+    def read(self, start, stop):
+        return np.asarray(self.data[start:stop], dtype="float32")
+
+    def get(self, rows):
+        """float32 vectors for rows (any order)."""
+        rows = np.asarray(rows, dtype="int64")
+        order = np.argsort(rows)
+        out = np.empty((len(rows), self.dtype.shape[0]), dtype="float32")
+        out[order] = self.data[rows[order]]  # sorted reads are sequential on disk
+        return out
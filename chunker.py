@@ -0,0 +1,124 @@
+import re
+
+MODEL_MAX_TOKENS = 256  # all-MiniLM-L6-v2 truncates anything longer
+
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+# Per source type: chunk size in tokens, sentences carried over into the next
+# chunk, and the fill level at which a paragraph break ends a chunk early.
+# Transcripts have no paragraphs or reliable punctuation, so they pack densely.
+PROFILES = {
+    "pdf": {"max_tokens": 200, "overlap_sentences": 1, "min_tokens": 80},
+    "url": {"max_tokens": 200, "overlap_sentences": 1, "min_tokens": 80},
+    "text": {"max_tokens": 200, "overlap_sentences": 1, "min_tokens": 80},
+    "transcript": {"max_tokens": 220, "overlap_sentences": 0, "min_tokens": 220},
+}
+
+
+def approx_token_counts(texts):
+    """Rough WordPiece count when no tokenizer is available (~1.3 tokens per word).
+
+    Not rounded, so the counts of the sentences (or words) in a chunk add up
+    to the count of the joined chunk; rounding each word up to 1 undercounts.
+    """
+    return [len(WORD_RE.findall(t)) * 1.3 for t in texts]
+
+
+def tokenizer_counts(tokenizer):
+    """Token counter backed by a Hugging Face tokenizer (e.g. SentenceTransformer.tokenizer)."""
+    def count(texts):
+        if not texts:
+            return []
+        return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+    return count
+
+
+def split_units(text):
+    """Split text into (sentence, ends_paragraph) pairs."""
+    units = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        sentences = [s.strip() for s in SENTENCE_RE.split(paragraph) if s.strip()]
+        units.extend((s, i == len(sentences) - 1) for i, s in enumerate(sentences))
+    return units
+
+
+class Chunker:
+    """Packs whole sentences into chunks of at most max_tokens tokens.
+
+    Chunks end at paragraph breaks once they hold min_tokens, carry the last
+    overlap_sentences sentences into the next chunk, and only split inside a
+    sentence when that sentence alone is over the limit.
+    """
+
+    def __init__(self, max_tokens=200, overlap_sentences=1, min_tokens=80, count_tokens=approx_token_counts):
+        self.max_tokens = min(max_tokens, MODEL_MAX_TOKENS)
+        self.overlap_sentences = overlap_sentences
+        self.min_tokens = min_tokens
+        self.count_tokens = count_tokens
+
+    def chunks(self, pages):
+        """Yield chunks from a stream of page texts, holding at most one page plus one chunk."""
+        current = []  # (sentence, tokens, is new) in the chunk being built
+        pending = ""
+        for i, page in enumerate(pages):
+            pending += ("\n" if i else "") + page
+            units = split_units(pending)
+            if not units:
+                continue
+            # The last sentence may continue on the next page, unless it's already
+            # so long (unpunctuated text) that holding it back would grow without bound
+            if len(units[-1][0]) > self.max_tokens * 8:
+                pending = ""
+                yield from self._pack(units, current)
+            else:
+                pending = units[-1][0]
+                yield from self._pack(units[:-1], current)
+        yield from self._pack(split_units(pending), current)
+        if any(new for _, _, new in current):
+            yield self._join(current)
+
+    def _pack(self, units, current):
+        counts = self.count_tokens([s for s, _ in units])
+        for (sentence, ends_paragraph), tokens in zip(units, counts):
+            for piece, piece_tokens in self._fit(sentence, tokens):
+                if current and sum(t for _, t, _ in current) + piece_tokens > self.max_tokens:
+                    yield self._join(current)
+                    self._carry_over(current, piece_tokens)
+                current.append((piece, piece_tokens, True))
+            if ends_paragraph and sum(t for _, t, _ in current) >= self.min_tokens:
+                yield self._join(current)
+                self._carry_over(current, 0)
+
+    def _carry_over(self, current, incoming):
+        overlap = current[-self.overlap_sentences:] if self.overlap_sentences else []
+        while overlap and sum(t for _, t, _ in overlap) + incoming > self.max_tokens // 2:
+            overlap = overlap[1:]
+        # Carried sentences alone never make a chunk of their own
+        current[:] = [(s, t, False) for s, t, _ in overlap]
+
+    def _fit(self, sentence, tokens):
+        """Split a sentence longer than max_tokens on word boundaries."""
+        if tokens <= self.max_tokens:
+            return [(sentence, tokens)]
+        words = sentence.split()
+        pieces, piece, piece_tokens = [], [], 0
+        for word, word_tokens in zip(words, self.count_tokens(words)):
+            if piece and piece_tokens + word_tokens > self.max_tokens:
+                pieces.append((" ".join(piece), piece_tokens))
+                piece, piece_tokens = [], 0
+            piece.append(word)
+            piece_tokens += word_tokens
+        if piece:
+            pieces.append((" ".join(piece), piece_tokens))
+        return pieces
+
+    def _join(self, current):
+        return " ".join(s for s, _, _ in current)
+
+
+def get_chunker(source_type="text", tokenizer=None):
+    profile = PROFILES.get(source_type, PROFILES["text"])
+    count = tokenizer_counts(tokenizer) if tokenizer is not None else approx_token_counts
+    return Chunker(count_tokens=count, **profile)
@@ -0,0 +1,165 @@
+"""Headless SmartBuddy ingestion.
+
+    python cli.py ingest docs/ paper.pdf --urls reading_list.txt   # ingest now, in this process
+    python cli.py submit docs/ https://example.com/post            # queue for a worker
+    python cli.py worker                                           # drain the queue (Ctrl+C to stop)
+    python cli.py jobs                                             # show recent jobs
+
+Add --workspace NAME to ingest into (or list jobs of) a separate knowledge base.
+"""
+import argparse
+import os
+import time
+from jobs import JobQueue, run_worker
+from workspaces import DEFAULT_WORKSPACE, WorkspaceManager, workspace_dir
+from ingest import BULK_BATCH_SIZE, ingest_directory, ingest_file, ingest_urls
+
+
+def is_url(target):
+    return target.startswith(("http://", "https://"))
+
+
+def read_urls(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def split_targets(targets, urls_file=None):
+    urls = [t for t in targets if is_url(t)] + (read_urls(urls_file) if urls_file else [])
+    paths = [t for t in targets if not is_url(t)]
+    for path in paths:
+        if not os.path.exists(path):
+            raise SystemExit(f"No such file or directory: {path}")
+    return paths, urls
+
+
+def report(source):
+    print(f"{source['name']}: {source['chunks']} chunks ({source['id']})")
+
+
+def print_throughput(docs, chunks, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print(f"{docs} docs, {chunks} chunks in {elapsed:.1f}s "
+          f"({docs / elapsed:.2f} docs/sec, {chunks / elapsed:.1f} chunks/sec)")
+
+
+def print_job(job):
+    done = f"{job['docs_done']}/{job['docs_total']} docs, {job['chunks_done']} chunks"
+    rate = f"{job['docs_per_s']:.2f} docs/sec, {job['chunks_per_s']:.1f} chunks/sec"
+    line = f"#{job['id']} {job['kind']:<9} {job['status']:<7} {done} ({rate})"
+    if job["error"]:
+        line += f" - {job['error']}"
+    print(line)
+
+
+def cmd_ingest(args):
+    from vector_store import VectorStore
+    paths, urls = split_targets(args.targets, args.urls)
+    vs = VectorStore(workspace_dir(args.workspace), encode_workers=args.encode_workers,
+                     encode_threads=args.encode_threads, quantization=args.quantization, encoder=args.encoder)
+    added = []
+
+    def on_source(source):
+        added.append(source)
+        report(source)
+
+    start = time.perf_counter()
+    for path in paths:
+        if os.path.isdir(path):
+            ingest_directory(vs, path, args.workers, args.batch_size, on_file=on_source)
+        else:
+            on_source(ingest_file(vs, path, workers=args.workers, batch_size=args.batch_size))
+    if urls:
+        ingest_urls(vs, urls, batch_size=args.batch_size, on_source=on_source)
+    print_throughput(len(added), sum(s["chunks"] for s in added), time.perf_counter() - start)
+    vs.close()  # fold the WAL so the app's next load doesn't replay it
+
+
+def cmd_submit(args):
+    paths, urls = split_targets(args.targets, args.urls)
+    queue = JobQueue()
+    ids = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            ids.append(queue.submit("directory", path=path, workers=args.workers, workspace=args.workspace))
+        else:
+            ids.append(queue.submit("file", path=path, name=os.path.basename(path), workspace=args.workspace))
+    if urls:
+        ids.append(queue.submit("urls", urls=urls, workspace=args.workspace))
+    print("Queued jobs: " + ", ".join(f"#{i}" for i in ids))
+
+
+def cmd_worker(args):
+    queue = JobQueue()
+    if args.requeue:
+        queue.requeue_stale(all_workers=True)
+    workspaces = WorkspaceManager(encode_workers=args.encode_workers, encode_threads=args.encode_threads,
+                                  quantization=args.quantization, encoder=args.encoder)
+    print("Worker started, waiting for jobs...")
+    try:
+        run_worker(workspaces, queue, once=args.once, on_job=print_job)
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_jobs(args):
+    for job in JobQueue().recent(args.limit, args.workspace):
+        print_job(job)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless SmartBuddy ingestion.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_workspace_arg(p, default=DEFAULT_WORKSPACE):
+        p.add_argument("--workspace", default=default, help="knowledge base to use (default: %(default)s)")
+
+    def add_encode_args(p):
+        p.add_argument("--encode-workers", type=int, default=1, help="embedding processes")
+        p.add_argument("--encode-threads", type=int, default=None, help="torch threads per embedding process")
+        p.add_argument("--encoder", choices=("torch", "onnx"), default=os.environ.get("EMBEDDING_ENCODER", "torch"),
+                       help="embedding runtime (onnx: int8 model via onnxruntime)")
+        p.add_argument("--quantization", choices=("fp16", "sq8"), default=os.environ.get("VECTOR_QUANTIZATION") or None,
+                       help="store index vectors at reduced precision")
+
+    ingest = commands.add_parser("ingest", help="ingest files, directories and URLs now")
+    ingest.add_argument("targets", nargs="*", help="files, directories or URLs")
+    ingest.add_argument("--urls", help="file with one URL or YouTube link per line")
+    ingest.add_argument("--workers", type=int, default=os.cpu_count(), help="PDF extraction processes")
+    ingest.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="chunks per index append")
+    add_workspace_arg(ingest)
+    add_encode_args(ingest)
+    ingest.set_defaults(func=cmd_ingest)
+
+    submit = commands.add_parser("submit", help="queue files, directories and URLs for a worker")
+    submit.add_argument("targets", nargs="*", help="files, directories or URLs")
+    submit.add_argument("--urls", help="file with one URL or YouTube link per line")
+    submit.add_argument("--workers", type=int, default=None, help="PDF extraction processes")
+    add_workspace_arg(submit)
+    submit.set_defaults(func=cmd_submit)
+
+    worker = commands.add_parser("worker", help="run queued ingestion jobs")
+    worker.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    worker.add_argument("--requeue", action="store_true", help="also retry jobs running on other hosts or live workers")
+    add_encode_args(worker)
+    worker.set_defaults(func=cmd_worker)
+
+    jobs = commands.add_parser("jobs", help="show recent jobs")
+    jobs.add_argument("--limit", type=int, default=20)
+    add_workspace_arg(jobs, default=None)
+    jobs.set_defaults(func=cmd_jobs)
+
+    args = parser.parse_args()
+    if args.command in ("ingest", "submit"):
+        try:
+            os.makedirs(workspace_dir(args.workspace), exist_ok=True)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.command in ("ingest", "submit") and not args.targets and not args.urls:
+        parser.error("give at least one file, directory or URL")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
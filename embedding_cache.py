@@ -0,0 +1,75 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+import metrics
+
+
+class EmbeddingCache:
+    """Persistent text -> embedding cache keyed by content hash and model name.
+
+    Entries are evicted least-recently-used first once the cache holds more
+    than max_entries vectors (~1.5 KB each for MiniLM).
+    """
+
+    def __init__(self, model_name, path="embeddings.db", max_entries=200_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def key(self, text):
+        h = hashlib.sha256()
+        h.update(self.model_name.encode("utf-8") + b"\0" + text.encode("utf-8"))
+        return h.hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's parameter limit
+                batch = keys[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+                self._conn.execute(f"UPDATE embeddings SET used = ? WHERE key IN ({marks})", [now, *batch])
+            self._conn.commit()
+        return found
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        rows = [(k, np.asarray(v, dtype="float32").tobytes(), now) for k, v in zip(keys, vectors)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                excess = self._count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY used LIMIT ?)", (excess,))
+                self._count -= excess
+            self._conn.commit()
+
+    def encode(self, encode_fn, texts):
+        """encode_fn(texts), only run on the texts not seen before."""
+        if not texts:
+            return np.empty((0, 0), dtype="float32")
+        keys = [self.key(t) for t in texts]
+        found = self.get_many(keys)
+        missing = [i for i, k in enumerate(keys) if k not in found]
+        metrics.incr("embed.cache_hits", len(keys) - len(missing))
+        metrics.incr("embed.cache_misses", len(missing))
+        if missing:
+            fresh = encode_fn([texts[i] for i in missing])
+            self.put_many([keys[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                found[keys[i]] = vector
+        return np.array([found[k] for k in keys], dtype="float32").reshape(len(texts), -1)
@@ -0,0 +1,62 @@
+import sqlite3
+import threading
+import time
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache()
+        return _cache
+
+
+class HttpCache:
+    """Persistent cache of fetched pages and transcripts, keyed by URL (or any string key).
+
+    Pages keep their ETag / Last-Modified validators so a refetch can be a
+    cheap conditional request. Past max_entries the least recently fetched
+    entries are dropped.
+    """
+
+    def __init__(self, path="http_cache.db", max_entries=2000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages "
+            "(key TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, fetched REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_fetched ON pages (fetched)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Return {"body", "etag", "last_modified", "fetched"} or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched FROM pages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"body": row[0], "etag": row[1], "last_modified": row[2], "fetched": row[3]}
+
+    def put(self, key, body, etag=None, last_modified=None):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                               (key, body, etag, last_modified, time.time()))
+            self._conn.execute(
+                "DELETE FROM pages WHERE key IN "
+                "(SELECT key FROM pages ORDER BY fetched DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._conn.commit()
+
+    def touch(self, key):
+        """Mark an entry as fresh again after a 304 Not Modified."""
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
@@ -0,0 +1,147 @@
+import math
+import faiss
+import numpy as np
+
+DIM = 384
+KINDS = ["flat", "hnsw", "ivf_flat", "ivf_pq"]
+
+# Largest corpus each kind is picked for when the store runs in "auto" mode.
+# Flat is exact and cheap to build for small corpora, HNSW keeps latency low
+# in the middle range, IVF trades a little recall for far less scan work and
+# PQ compresses vectors from 1.5 KB to 48 bytes once memory dominates.
+AUTO_TIERS = [(20_000, "flat"), (200_000, "hnsw"), (1_000_000, "ivf_flat"), (None, "ivf_pq")]
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_SUBQUANTIZERS = 48  # 384 / 48 = 8 dims per 8-bit code
+TRAIN_POINTS_PER_LIST = 64
+MIN_IVF_ROWS = 25_000  # below this k-means has too few points per list
+MIN_SQ8_ROWS = 1_000  # sq8 learns per-dimension ranges, so it needs a sample first
+SQ_TRAIN_POINTS = 20_000
+
+# Optional reduced-precision storage for the flat, HNSW and IVF-Flat kinds:
+# 2 bytes (fp16) or 1 byte (sq8) per dimension instead of 4. IVF-PQ is
+# already compressed and ignores it.
+QUANTIZATIONS = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def choose_kind(ntotal):
+    for limit, kind in AUTO_TIERS:
+        if limit is None or ntotal < limit:
+            return kind
+
+
+def can_build(kind, ntotal, quantization=None):
+    if quantization == "sq8" and ntotal < MIN_SQ8_ROWS:
+        return False
+    return not kind.startswith("ivf") or ntotal >= MIN_IVF_ROWS
+
+
+def index_kind(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_quantization(index):
+    """"fp16", "sq8", "pq" or None (full float32 vectors)."""
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "pq"
+    sq = getattr(index, "sq", None)
+    for name, qtype in QUANTIZATIONS.items():
+        if sq is not None and sq.qtype == qtype:
+            return name
+    return None
+
+
+def is_lossy(index):
+    """Whether scores from this index are approximate and worth rescoring with exact vectors."""
+    return index_quantization(index) in ("sq8", "pq")
+
+
+def nlist_for(ntotal):
+    return max(1, min(65536, int(4 * math.sqrt(max(ntotal, 1)))))
+
+
+def build_index(kind, ntotal, dim=DIM, quantization=None):
+    """Create an empty inner-product index of the given kind sized for ntotal vectors.
+
+    quantization ("fp16" / "sq8") stores vectors at reduced precision.
+    """
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    qtype = QUANTIZATIONS.get(quantization)
+    if kind == "flat":
+        if qtype is not None:
+            return faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    quantizer = faiss.IndexFlatIP(dim)
+    if kind == "ivf_flat":
+        if qtype is not None:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist_for(ntotal), qtype,
+                                                 faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist_for(ntotal), faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dim, nlist_for(ntotal), PQ_SUBQUANTIZERS, 8,
+                                faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index kind: {kind}")
+
+
+def train_index(index, vectors, seed=0):
+    if index.is_trained:
+        return
+    n = index.nlist * TRAIN_POINTS_PER_LIST if isinstance(index, faiss.IndexIVF) else SQ_TRAIN_POINTS
+    if len(vectors) > n:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), n, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype="float32"))
+    if isinstance(index, faiss.IndexIVF):
+        # Keep rows reconstructable so the index can be migrated again later
+        index.make_direct_map()
+
+
+def reconstruct_rows(index, start, stop):
+    if stop <= start:
+        return np.empty((0, index.d), dtype="float32")
+    return index.reconstruct_n(start, stop - start)
+
+
+def search_params(index, selector=None, nprobe=16, ef_search=64):
+    """Return SearchParameters carrying the recall/latency knobs for this index kind."""
+    kind = index_kind(index)
+    extra = {} if selector is None else {"sel": selector}
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search, **extra)
+    if kind in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe, **extra)
+    return faiss.SearchParameters(**extra) if extra else None
+
+
+def evaluate_recall(index, vectors, k=10, n_queries=200, params=None, seed=0):
+    """Recall@k of index against an exact inner-product search over vectors.
+
+    Queries are sampled from the corpus itself, so vectors must be the exact
+    (unquantized) rows the index was built from.
+    """
+    rng = np.random.default_rng(seed)
+    n_queries = min(n_queries, len(vectors))
+    if n_queries == 0:
+        return 1.0
+    queries = vectors[rng.choice(len(vectors), n_queries, replace=False)]
+    _, expected = faiss.knn(queries, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+    _, found = index.search(queries, k, params=params)
+    hits = sum(len(set(e[e >= 0]) & set(f[f >= 0])) for e, f in zip(expected, found))
+    return hits / float(n_queries * min(k, len(vectors)))
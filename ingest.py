@@ -0,0 +1,193 @@
+import copy
+import os
+import queue
+import threading
+import uuid
+from chunker import get_chunker
+import metrics
+from loader import is_youtube_url, load_urls, load_yt_transcripts, open_pdf_pages_parallel
+
+BATCH_SIZE = 64
+BULK_BATCH_SIZE = 512  # big enough to be sharded across encode workers
+INGEST_EXTENSIONS = (".pdf", ".txt", ".md")
+PREFETCH_BATCHES = 4
+
+_DONE = object()
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def batched(items, n):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items, maxsize):
+    """Iterate items on a background thread, keeping at most maxsize ready ahead.
+
+    Lets text extraction run while the caller is busy encoding the previous batch.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        q.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            q.put(_DONE)
+        except BaseException as e:
+            q.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def chunk_tokenizer(vs):
+    """A private copy of the store's tokenizer for the chunking thread.
+
+    Fast tokenizers raise "Already borrowed" when one instance is used from
+    two threads, and the model is encoding on the caller's thread meanwhile.
+    """
+    with _tokenizers_lock:
+        if vs.model_name not in _tokenizers:
+            _tokenizers[vs.model_name] = copy.deepcopy(vs.model.tokenizer)
+        return _tokenizers[vs.model_name]
+
+
+def ingest_pages(vs, pages, source_id, source_type="text", batch_size=BATCH_SIZE, on_progress=None):
+    """Stream pages -> chunks -> embedding batches -> index appends.
+
+    Chunks are sized in model tokens using the chunker profile for source_type
+    ("pdf", "url", "transcript" or "text").
+
+    Only one batch of chunks (plus a few prefetched ones) is held in memory at
+    a time. on_progress(pages_done, chunks_done) is called on the caller's
+    thread after every batch. Returns the number of chunks added.
+    """
+    counter = {"pages": 0}
+
+    def count_pages():
+        for page in pages:
+            counter["pages"] += 1
+            yield page
+
+    chunker = get_chunker(source_type, chunk_tokenizer(vs))
+    chunks_done = 0
+    for batch in prefetch(batched(chunker.chunks(count_pages()), batch_size), PREFETCH_BATCHES):
+        vs.add_texts(batch, source_id)
+        chunks_done += len(batch)
+        metrics.incr("ingest.chunks", len(batch))
+        if on_progress:
+            on_progress(counter["pages"], chunks_done)
+    metrics.incr("ingest.pages", counter["pages"])
+    return chunks_done
+
+
+def iter_files(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(INGEST_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def ingest_file(vs, path, name=None, workers=None, batch_size=BULK_BATCH_SIZE, on_progress=None):
+    """Ingest one PDF or text file as a new source; returns its {"id", "name", "chunks"} dict.
+
+    Raises ValueError for any other kind of file (see INGEST_EXTENSIONS).
+    """
+    if not path.lower().endswith(INGEST_EXTENSIONS):
+        raise ValueError(f"Unsupported file type: {os.path.basename(path)} "
+                         f"(supported: {', '.join(INGEST_EXTENSIONS)})")
+    if path.lower().endswith(".pdf"):
+        _, pages = open_pdf_pages_parallel(path, workers)
+        source_type = "pdf"
+    else:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages = [f.read()]
+        source_type = "text"
+    source = {"id": str(uuid.uuid4()), "name": name or os.path.basename(path)}
+    source["chunks"] = ingest_pages(vs, pages, source["id"], source_type, batch_size=batch_size,
+                                    on_progress=on_progress)
+    if source["chunks"]:
+        vs.registry.add(source["id"], source["name"], source_type, source["chunks"])
+    return source
+
+
+def ingest_text(vs, text, name, source_type="text", batch_size=BATCH_SIZE, on_progress=None):
+    """Ingest already-loaded text (pasted text, a page, a transcript) as a new source."""
+    source = {"id": str(uuid.uuid4()), "name": name}
+    source["chunks"] = ingest_pages(vs, [text], source["id"], source_type, batch_size=batch_size,
+                                    on_progress=on_progress)
+    if source["chunks"]:
+        vs.registry.add(source["id"], name, source_type, source["chunks"])
+    return source
+
+
+def ingest_directory(vs, directory, workers=None, batch_size=BULK_BATCH_SIZE, on_file=None):
+    """Ingest every PDF/text file under directory, one source per file.
+
+    PDF pages are extracted across `workers` processes; embedding is sharded
+    according to the store's encode_workers. Returns a list of
+    {"id", "name", "chunks"} dicts, also passed to on_file as each file finishes.
+    """
+    added = []
+    for path in iter_files(directory):
+        source = ingest_file(vs, path, os.path.relpath(path, directory), workers, batch_size)
+        added.append(source)
+        if on_file:
+            on_file(source)
+    return added
+
+
+def ingest_urls(vs, urls, workers=None, batch_size=BULK_BATCH_SIZE, on_source=None, on_error=None):
+    """Ingest a reading list of web pages and YouTube links, one source per URL.
+
+    Pages and transcripts are fetched concurrently (and cached on disk) before
+    embedding. Returns {"id", "name", "chunks"} dicts like ingest_directory;
+    URLs that fail to load are skipped and reported to on_error(url, message).
+    """
+    urls = [u.strip() for u in urls if u.strip()]
+    videos = [u for u in urls if is_youtube_url(u)]
+    pages = [u for u in urls if not is_youtube_url(u)]
+    kwargs = {"workers": workers} if workers else {}
+    texts = dict(zip(videos, load_yt_transcripts(videos, **kwargs)))
+    texts.update(zip(pages, load_urls(pages, **kwargs)))
+
+    added = []
+    for url in urls:
+        text = texts[url]
+        if text.startswith("[Error"):
+            metrics.incr("ingest.url_errors")
+            if on_error:
+                on_error(url, text)
+            continue
+        if url in videos:
+            source = ingest_text(vs, text, f"YouTube: {url}", "transcript", batch_size)
+        else:
+            source = ingest_text(vs, text, f"URL: {url}", "url", batch_size)
+        added.append(source)
+        if on_source:
+            on_source(source)
+    return added
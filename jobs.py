@@ -0,0 +1,270 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from ingest import ingest_directory, ingest_file, ingest_text, ingest_urls, iter_files
+from workspaces import DEFAULT_WORKSPACE
+
+JOB_KINDS = ("file", "directory", "urls", "text", "rebuild")
+POLL_INTERVAL = 1.0
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+MAX_ERRORS_SHOWN = 5
+HEARTBEAT_SECONDS = 30  # a worker refreshes its running job's heartbeat this often...
+HEARTBEAT_TIMEOUT = 5 * 60  # ...and a job on another host whose heartbeat is older is requeued
+UPLOAD_DIR = "uploads"  # files submitted from the UI wait here until their job has run
+
+_queue = None
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _queue
+    with _worker_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+class JobQueue:
+    """SQLite-backed ingestion queue shared by the UI, the CLI and any number of workers.
+
+    A job is one of JOB_KINDS with a JSON payload (including the workspace it
+    ingests into); workers claim queued jobs atomically, so several processes
+    can drain the same queue.
+    """
+
+    def __init__(self, path="jobs.db"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, payload TEXT, "
+            "status TEXT, submitted REAL, started REAL, finished REAL, docs_total INTEGER DEFAULT 0, "
+            "docs_done INTEGER DEFAULT 0, chunks_done INTEGER DEFAULT 0, error TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        for column in ("worker TEXT", "heartbeat REAL"):  # host:pid running the job, its last sign of life
+            try:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass  # already there
+        self._conn.commit()
+
+    def submit(self, kind, **payload):
+        """Queue a job and return its id."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, payload, status, submitted) VALUES (?, ?, 'queued', ?)",
+                (kind, json.dumps(payload), time.time()))
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def claim(self):
+        """Mark the oldest queued job as running and return it, or None if the queue is empty."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # no other worker can claim the same row
+            row = self._conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                self._conn.commit()
+                return None
+            now = time.time()
+            self._conn.execute("UPDATE jobs SET status = 'running', started = ?, worker = ?, heartbeat = ? "
+                               "WHERE id = ?", (now, WORKER_ID, now, row[0]))
+            self._conn.commit()
+        return self.get(row[0])
+
+    def progress(self, job_id, docs_total=None, docs_done=None, chunks_done=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET docs_total = COALESCE(?, docs_total), docs_done = COALESCE(?, docs_done), "
+                "chunks_done = COALESCE(?, chunks_done) WHERE id = ?", (docs_total, docs_done, chunks_done, job_id))
+            self._conn.commit()
+
+    def heartbeat(self, job_id):
+        """Record that the worker running job_id is still alive."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+            self._conn.commit()
+
+    def finish(self, job_id, error=None, failed=None):
+        """Mark a job done, or failed (by default whenever there's an error message)."""
+        failed = bool(error) if failed is None else failed
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                               ("failed" if failed else "done", time.time(), error, job_id))
+            self._conn.commit()
+
+    def requeue_stale(self, all_workers=False):
+        """Put jobs left 'running' by a worker that died back in the queue.
+
+        A worker on this host is dead once its process is gone; one on another
+        host once its heartbeat is older than HEARTBEAT_TIMEOUT.
+        all_workers=True requeues every running job.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, worker, heartbeat FROM jobs WHERE status = 'running'").fetchall()
+            stale = [job_id for job_id, worker, heartbeat in rows
+                     if all_workers or not _worker_alive(worker, heartbeat)]
+            self._conn.executemany("UPDATE jobs SET status = 'queued', started = NULL WHERE id = ?",
+                                   [(job_id,) for job_id in stale])
+            self._conn.commit()
+        return len(stale)
+
+    def get(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        return _job(cursor, row) if row else None
+
+    def recent(self, limit=10, workspace=None):
+        """The latest jobs, newest first; only those for `workspace` if given."""
+        with self._lock:
+            if workspace is None:
+                cursor = self._conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+            else:
+                cursor = self._conn.execute(
+                    "SELECT * FROM jobs WHERE COALESCE(json_extract(payload, '$.workspace'), ?) = ? "
+                    "ORDER BY id DESC LIMIT ?", (DEFAULT_WORKSPACE, workspace, limit))
+            rows = cursor.fetchall()
+        return [_job(cursor, row) for row in rows]
+
+
+def _worker_alive(worker, heartbeat=None):
+    """Whether the process that claimed a job may still be running it."""
+    host, _, pid = (worker or "").rpartition(":")
+    if not pid.isdigit():
+        return False  # claimed before workers were recorded
+    if host != socket.gethostname() or os.name == "nt":
+        # Can't check the process (and on Windows os.kill(pid, 0) would terminate it)
+        return heartbeat is not None and time.time() - heartbeat < HEARTBEAT_TIMEOUT
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by another user
+    return True
+
+
+def _job(cursor, row):
+    job = dict(zip([c[0] for c in cursor.description], row))
+    job["payload"] = json.loads(job["payload"])
+    # Throughput over the time the job has been running so far
+    elapsed = ((job["finished"] or time.time()) - job["started"]) if job["started"] else 0
+    job["elapsed"] = elapsed
+    job["docs_per_s"] = job["docs_done"] / elapsed if elapsed else 0.0
+    job["chunks_per_s"] = job["chunks_done"] / elapsed if elapsed else 0.0
+    return job
+
+
+def run_job(vs, queue, job):
+    """Execute one claimed job, recording progress as it goes.
+
+    Returns the messages for inputs that couldn't be ingested (e.g. URLs
+    that failed to load); raises when the job can't run at all.
+    """
+    job_id, payload = job["id"], job["payload"]
+    done = {"docs": 0, "chunks": 0}
+    errors = []
+
+    def source_done(source):
+        done["docs"] += 1
+        done["chunks"] += source["chunks"]
+        queue.progress(job_id, docs_done=done["docs"], chunks_done=done["chunks"])
+
+    def chunk_progress(pages_done, chunks_done):
+        queue.progress(job_id, chunks_done=done["chunks"] + chunks_done)
+
+    if job["kind"] == "file":
+        queue.progress(job_id, docs_total=1)
+        try:
+            source_done(ingest_file(vs, payload["path"], payload.get("name"), on_progress=chunk_progress))
+        finally:
+            if payload.get("delete_after"):
+                os.remove(payload["path"])
+    elif job["kind"] == "directory":
+        if not os.path.isdir(payload["path"]):
+            raise FileNotFoundError(f"No such directory: {payload['path']}")
+        queue.progress(job_id, docs_total=sum(1 for _ in iter_files(payload["path"])))
+        ingest_directory(vs, payload["path"], payload.get("workers"), on_file=source_done)
+    elif job["kind"] == "urls":
+        queue.progress(job_id, docs_total=len(payload["urls"]))
+        ingest_urls(vs, payload["urls"], on_source=source_done, on_error=lambda url, text: errors.append(text))
+    elif job["kind"] == "text":
+        queue.progress(job_id, docs_total=1)
+        source_done(ingest_text(vs, payload["text"], payload["name"], payload.get("source_type", "text"),
+                                on_progress=chunk_progress))
+    elif job["kind"] == "rebuild":
+        queue.progress(job_id, chunks_done=vs.rebuild())  # rows reclaimed
+    return errors
+
+
+def run_worker(workspaces, queue, once=False, poll_interval=POLL_INTERVAL, on_job=None):
+    """Claim and run jobs until the queue is empty (once=True) or forever.
+
+    Each job runs against its workspace's store, loaded through `workspaces`
+    (a WorkspaceManager) and kept in memory while the job runs, with its
+    heartbeat refreshed every HEARTBEAT_SECONDS. Jobs left running by a worker
+    that has since died are queued again, at start and then whenever the
+    queue is idle.
+    """
+    queue.requeue_stale()
+    swept = time.monotonic()
+    while True:
+        job = queue.claim()
+        if job is None:
+            if once:
+                return
+            if time.monotonic() - swept >= HEARTBEAT_SECONDS:
+                queue.requeue_stale()
+                swept = time.monotonic()
+            time.sleep(poll_interval)
+            continue
+        error, failed = None, None
+        stop = threading.Event()
+        threading.Thread(target=_beat, args=(queue, job["id"], stop), daemon=True).start()
+        try:
+            with workspaces.use(job["payload"].get("workspace", DEFAULT_WORKSPACE)) as vs:
+                errors = run_job(vs, queue, job)
+            if errors:
+                error = "; ".join(errors[:MAX_ERRORS_SHOWN])
+                if len(errors) > MAX_ERRORS_SHOWN:
+                    error += f" (and {len(errors) - MAX_ERRORS_SHOWN} more)"
+                # Partly ingested jobs finish as done, with the failures noted
+                failed = queue.get(job["id"])["docs_done"] == 0
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            stop.set()
+        queue.finish(job["id"], error, failed)
+        if on_job:
+            on_job(queue.get(job["id"]))
+
+
+def _beat(queue, job_id, stop):
+    while not stop.wait(HEARTBEAT_SECONDS):
+        queue.heartbeat(job_id)
+
+
+def start_worker(workspaces, queue):
+    """Run a worker on a background thread of this process (once), e.g. inside the Streamlit server."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=run_worker, args=(workspaces, queue), daemon=True)
+            _worker.start()
+        return _worker
+
+
+def save_upload(name, data):
+    """Write an uploaded file where a worker can read it; returns the path."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, f"{time.time_ns()}_{os.path.basename(name)}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
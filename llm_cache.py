@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+_caches = {}
+_cache_lock = threading.Lock()
+
+
+def normalize_prompt(prompt):
+    # Prompts are built from indented f-strings; indentation doesn't change the answer
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def get_response_cache(directory="."):
+    """The response cache of the store (workspace) in directory; row ids only mean something there."""
+    with _cache_lock:
+        if directory not in _caches:
+            _caches[directory] = ResponseCache(os.path.join(directory, "responses.db"))
+        return _caches[directory]
+
+
+class ResponseCache:
+    """Persistent LLM response cache keyed on model, normalized prompt and retrieved chunk ids.
+
+    Entries expire after ttl seconds; past max_entries the oldest are dropped.
+    Each entry remembers the chunk ids it was built from so deleting or
+    re-ingesting a source can invalidate every answer that used it.
+    """
+
+    def __init__(self, path="responses.db", ttl=7 * 24 * 3600, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS response_chunks (key TEXT, chunk INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_chunks_chunk ON response_chunks (chunk)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_chunks_key ON response_chunks (key)")
+        self._conn.commit()
+
+    def key(self, model, prompt, chunk_ids=()):
+        raw = json.dumps([model, normalize_prompt(prompt), sorted(int(i) for i in chunk_ids)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def put(self, key, response, chunk_ids=()):
+        now = time.time()
+        with self._lock:
+            self._delete("SELECT key FROM responses WHERE key = ?", (key,))
+            self._conn.execute("INSERT INTO responses VALUES (?, ?, ?)", (key, response, now))
+            self._conn.executemany("INSERT INTO response_chunks VALUES (?, ?)",
+                                   [(key, int(i)) for i in set(chunk_ids)])
+            self._delete("SELECT key FROM responses WHERE created < ?", (now - self.ttl,))
+            self._delete("SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?",
+                         (self.max_entries,))
+            self._conn.commit()
+
+    def invalidate_chunks(self, chunk_ids):
+        """Drop every cached response that was built from any of chunk_ids."""
+        chunk_ids = [int(i) for i in chunk_ids]
+        with self._lock:
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                self._delete(f"SELECT key FROM response_chunks WHERE chunk IN ({marks})", batch)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM response_chunks")
+            self._conn.commit()
+
+    def _delete(self, select_keys, params):
+        keys = [(k,) for (k,) in self._conn.execute(select_keys, params).fetchall()]
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._conn.executemany("DELETE FROM response_chunks WHERE key = ?", keys)
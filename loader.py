@@ -1,28 +1,252 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PyPDF2 import PdfReader
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, VideoUnavailable
+from http_cache import get_http_cache
+import metrics
 
-def load_pdf(file):
+def open_pdf_pages(file):
+    """Return (page count, generator of page texts); pages are extracted lazily."""
     pdf = PdfReader(file)
-    return "\n".join([page.extract_text() for page in pdf.pages])
+    return len(pdf.pages), (page.extract_text() or "" for page in pdf.pages)
+
+PAGES_PER_TASK = 16
+PARALLEL_MIN_PAGES = 64  # below this, process start-up costs more than it saves
+
+_pdf_pool = None
+
+def _get_pdf_pool(workers):
+    global _pdf_pool
+    if _pdf_pool is None:
+        # Spawned, not forked: a fork of the threaded app or worker can inherit locks held by other threads
+        _pdf_pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+def _extract_pages(path, start, stop):
+    pdf = PdfReader(path)
+    return [pdf.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def open_pdf_pages_parallel(source, workers=None):
+    """Like open_pdf_pages, but extracts page ranges across worker processes.
+
+    source is a file path, bytes or a file-like object. Only a few ranges per
+    worker are in flight at once, so memory stays bounded for huge PDFs.
+    """
+    tmp_path = None
+    if not isinstance(source, (str, os.PathLike)):
+        data = source if isinstance(source, bytes) else source.read()
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(data)
+        source = tmp_path = tmp.name
+
+    total = len(PdfReader(source).pages)
+    metrics.incr("loader.pdf_pages", total)
+    if total < PARALLEL_MIN_PAGES:
+        def pages():
+            try:
+                yield from _extract_pages(source, 0, total)
+            finally:
+                if tmp_path:
+                    os.remove(tmp_path)
+        return total, pages()
+
+    def pages():
+        pool = _get_pdf_pool(workers)
+        max_in_flight = 2 * (workers or os.cpu_count() or 1)
+        ranges = deque((start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK))
+        in_flight = deque()
+        try:
+            while ranges or in_flight:
+                while ranges and len(in_flight) < max_in_flight:
+                    in_flight.append(pool.submit(_extract_pages, source, *ranges.popleft()))
+                yield from in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if tmp_path:
+                os.remove(tmp_path)
+    return total, pages()
+
+def load_pdf(file):
+    return "\n".join(open_pdf_pages(file)[1])
 
 def load_text(file):
     return file.read().decode("utf-8")
 
-def load_url(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
-    return soup.get_text()
+FETCH_TIMEOUT = (5, 20)  # connect, read seconds
+FETCH_RETRIES = 3
+FETCH_WORKERS = 8
+CACHE_FRESH_SECONDS = 600  # reuse a cached page without revalidating for this long
+TRANSCRIPT_CACHE_SECONDS = 7 * 24 * 3600  # transcripts don't change; refetch weekly at most
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "form",
+                    "nav", "header", "footer", "aside"]
+# Elements that start a new paragraph; anything else (b, a, span, ...) flows inline
+BLOCK_TAGS = frozenset(["p", "div", "section", "article", "main", "h1", "h2", "h3", "h4", "h5", "h6",
+                        "ul", "ol", "li", "dl", "dt", "dd", "pre", "blockquote", "table", "tr",
+                        "figure", "figcaption", "details", "summary", "address", "hr"])
+BLOCK_BREAK = "\x00"  # markers put in the text while walking the page, never in a real one
+LINE_BREAK = "\x01"
+
+try:
+    import lxml  # noqa: F401  (only needed as BeautifulSoup's parser)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+_session = None
+_session_lock = threading.Lock()
+
+class _TimeoutSession(requests.Session):
+    """Session whose requests time out after FETCH_TIMEOUT unless given their own timeout.
 
-def load_yt_transcript(url):
+    Library code that gets the session (youtube-transcript-api) never passes one.
+    """
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = FETCH_TIMEOUT
+        return super().request(method, url, **kwargs)
+
+def get_http_session():
+    """Shared requests.Session with a connection pool, retries on transient errors and a default timeout."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=FETCH_RETRIES, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+            adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS, max_retries=retry)
+            _session = _TimeoutSession()
+            _session.headers["User-Agent"] = "SmartBuddy/1.0"
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def fetch_url(url, session=None, cache=None, timeout=FETCH_TIMEOUT):
+    """GET url as bytes through the HTTP cache, revalidating with ETag / Last-Modified."""
+    session = session or get_http_session()
+    cache = cache or get_http_cache()
+    cached = cache.get(url)
+    if cached and time.time() - cached["fetched"] < CACHE_FRESH_SECONDS:
+        metrics.incr("http_cache.hits")
+        return cached["body"]
+
+    headers = {}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+    with metrics.span("loader.fetch"):
+        response = session.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        metrics.incr("http_cache.revalidated")
+        cache.touch(url)
+        return cached["body"]
+    metrics.incr("http_cache.misses")
+    response.raise_for_status()
+    cache.put(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.content
+
+def _marked_text(root):
+    """root's text, with BLOCK_BREAK around block elements and LINE_BREAK for <br>."""
+    parts = []
+    stack = [(iter(root.children), "")]  # children still to visit, text to add after them
+    while stack:
+        children, closing = stack[-1]
+        node = next(children, None)
+        if node is None:
+            stack.pop()
+            parts.append(closing)
+        elif isinstance(node, Tag):
+            if node.name == "br":
+                parts.append(LINE_BREAK)
+            elif node.name in BLOCK_TAGS:
+                parts.append(BLOCK_BREAK)
+                stack.append((iter(node.children), BLOCK_BREAK))
+            else:
+                stack.append((iter(node.children), " " if node.name in ("td", "th") else ""))
+        elif type(node) in (NavigableString, CData):  # not comments or doctypes
+            parts.append(node)
+    return "".join(parts)
+
+def html_to_text(content):
+    """Readable text of an HTML page, without scripts, navigation, headers and footers.
+
+    Block elements become paragraphs separated by a blank line (so chunkers
+    can break on them); inline elements stay part of their sentence.
+    """
+    with metrics.span("loader.html_to_text"):
+        soup = BeautifulSoup(content, HTML_PARSER)
+        for tag in soup(BOILERPLATE_TAGS):
+            tag.decompose()
+        # Prefer the page's main content when it marks it up
+        body = soup.find("article") or soup.find("main") or soup.body or soup
+        paragraphs = []
+        for block in _marked_text(body).split(BLOCK_BREAK):
+            lines = (" ".join(line.split()) for line in block.split(LINE_BREAK))
+            paragraph = "\n".join(line for line in lines if line)
+            if paragraph:
+                paragraphs.append(paragraph)
+        return "\n\n".join(paragraphs)
+
+def load_url(url, session=None, cache=None):
+    return html_to_text(fetch_url(url, session, cache))
+
+def load_urls(urls, workers=FETCH_WORKERS, session=None, cache=None):
+    """Fetch and extract many pages concurrently; returns texts in input order.
+
+    A page that can't be loaded comes back as an "[Error loading URL] ..." string.
+    """
+    def load(url):
+        try:
+            return load_url(url, session, cache)
+        except Exception as e:
+            return f"[Error loading URL] {url}: {str(e)}"
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(load, urls))
+
+def youtube_video_id(url):
+    """Video id from a watch URL, a youtu.be short link or a bare id."""
+    if "youtu.be/" in url:
+        return url.split("youtu.be/")[-1].split("?")[0].split("&")[0]
+    return url.split("v=")[-1].split("&")[0]
+
+def _fetch_transcript(video_id, session):
+    # One api object per call: it isn't thread-safe, but the pooled session it wraps is
+    return " ".join(snippet.text for snippet in YouTubeTranscriptApi(http_client=session).fetch(video_id))
+
+def load_yt_transcript(url, session=None, cache=None):
+    cache = cache or get_http_cache()
     try:
-        video_id = url.split("v=")[-1].split("&")[0]
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
-        return " ".join([i["text"] for i in transcript])
+        video_id = youtube_video_id(url)
+        key = f"youtube-transcript:{video_id}"
+        cached = cache.get(key)
+        if cached and time.time() - cached["fetched"] < TRANSCRIPT_CACHE_SECONDS:
+            metrics.incr("http_cache.hits")
+            return cached["body"].decode("utf-8")
+        metrics.incr("http_cache.misses")
+        with metrics.span("loader.transcript"):
+            text = _fetch_transcript(video_id, session or get_http_session())
+        cache.put(key, text.encode("utf-8"))
+        return text
     except TranscriptsDisabled:
         return "[Error: Transcripts are disabled for this video]"
     except VideoUnavailable:
         return "[Error: Video is unavailable]"
     except Exception as e:
         return f"[Error loading transcript] {str(e)}"
+
+def load_yt_transcripts(urls, workers=FETCH_WORKERS, session=None, cache=None):
+    """Fetch many transcripts concurrently; returns texts (or error strings) in input order."""
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(lambda url: load_yt_transcript(url, session, cache), urls))
+
+def is_youtube_url(url):
+    return "youtube.com" in url or "youtu.be" in url
@@ -1,9 +1,18 @@
 import streamlit as st
-import uuid
-from loader import load_pdf, load_text, load_url, load_yt_transcript
-from vector_store import VectorStore
-from ollama_chat import call_deepseek
+import os
+from prompting import ConversationMemory, build_chat_prompt, build_context
+from smart_tools import context_parts, generate, text_parts
+from voice_notes import TRANSCRIBER, TRANSCRIBERS, get_note_indexer, get_note_store, transcribe
+from jobs import get_job_queue, save_upload, start_worker
+from ingest import INGEST_EXTENSIONS
+from workspaces import DEFAULT_WORKSPACE, get_workspaces
+from ollama_chat import OllamaError, cached_stream, preload_model, split_response
 import re
+import html
+import time
+import logging
+import requests
+import metrics
 import speech_recognition as sr 
 
 
@@ -11,14 +20,69 @@ import speech_recognition as sr
 st.set_page_config("NotebookLM Clone", layout="wide")
 st.title("🧠 SmartBuddy")
 
-vs = VectorStore()
+# Each workspace is its own knowledge base; indexes load on first use and are
+# unloaded when idle, while the embedding model is shared by all of them
+workspaces = get_workspaces()
+if "workspace" not in st.session_state:
+    # ?workspace=<name> links straight to a knowledge base
+    params = st.query_params if hasattr(st, "query_params") else {}
+    st.session_state.workspace = params.get("workspace", DEFAULT_WORKSPACE)
+    if not workspaces.exists(st.session_state.workspace):
+        st.session_state.workspace = DEFAULT_WORKSPACE
+
+st.sidebar.header("🗂️ Workspace")
+names = workspaces.list()
+workspace = st.sidebar.selectbox("Knowledge base", names, index=names.index(st.session_state.workspace)
+                                 if st.session_state.workspace in names else 0)
+with st.sidebar.expander("➕ New workspace"):
+    new_workspace = st.text_input("Name (letters, digits, - and _)")
+    if st.button("Create") and new_workspace:
+        try:
+            workspace = workspaces.create(new_workspace.strip())
+        except ValueError as e:
+            st.warning(f"⚠️ {e}")
+if workspace != st.session_state.workspace:
+    # A new knowledge base starts a new conversation
+    st.session_state.workspace = workspace
+    st.session_state.chat_history = []
+    st.session_state.memory = ConversationMemory()
+    if hasattr(st, "query_params"):
+        st.query_params["workspace"] = workspace
+    st.rerun()
+
+vs = workspaces.get(workspace)
+preload_model()
+
+# Voice notes are indexed as their own source of the workspace they were recorded in
+# (voice_to_speech.py records into the default workspace)
+note_store = get_note_store(vs.directory)
+note_indexer = get_note_indexer(vs)
+if note_store.count(unindexed_only=True):
+    note_indexer.schedule()
+
+# Ingestion jobs run on a worker thread in this process, unless a separate `python cli.py worker` drains the queue
+job_queue = get_job_queue()
+if os.environ.get("INGEST_WORKER") != "external":
+    start_worker(workspaces, job_queue)
+
+# Optional observability: METRICS_PORT serves Prometheus text at /metrics, METRICS_LOG logs every span as JSON
+if os.environ.get("METRICS_PORT"):
+    metrics.start_metrics_server(int(os.environ["METRICS_PORT"]))
+if os.environ.get("METRICS_LOG"):
+    logging.basicConfig()
+    metrics.log.setLevel(logging.DEBUG)
 
 # --- Session State Init ---
-if "sources" not in st.session_state:
-    st.session_state.sources = []
+# Sources live in the store's registry; a session only remembers which ones it unchecked
+if "unchecked" not in st.session_state:
+    st.session_state.unchecked = set()
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+    st.session_state.memory = ConversationMemory()
+
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
 
 if "user_input" not in st.session_state:
     st.session_state["user_input"] = ""
@@ -28,53 +92,121 @@ if "quiz_question" not in st.session_state:
 
 # --- Sidebar Upload Panel ---
 st.sidebar.header("📥 Upload Knowledge")
-uploaded_file = st.sidebar.file_uploader("Upload File (PDF/TXT)", type=["pdf", "txt", "docx", "csv"])
+uploaded_file = st.sidebar.file_uploader("Upload File (PDF/TXT/MD)", type=[e.lstrip(".") for e in INGEST_EXTENSIONS])
 url_input = st.sidebar.text_input("Enter a URL or YouTube Link")
 text_input = st.sidebar.text_area("Paste raw text here")
 
 if st.sidebar.button("➕ Add to Knowledge Base"):
-    text_data, source_name = "", ""
-
+    # Ingestion runs on the job worker, so the UI stays responsive while big files embed
+    job_id = None
     if uploaded_file:
-        text_data = load_pdf(uploaded_file) if uploaded_file.name.endswith(".pdf") else load_text(uploaded_file)
-        source_name = uploaded_file.name
+        path = save_upload(uploaded_file.name, uploaded_file.getvalue())
+        job_id = job_queue.submit("file", path=path, name=uploaded_file.name, delete_after=True, workspace=workspace)
     elif url_input:
-        if "youtube.com" in url_input or "youtu.be" in url_input:
-            text_data = load_yt_transcript(url_input)
-            source_name = f"YouTube: {url_input}"
-        else:
-            text_data = load_url(url_input)
-            source_name = f"URL: {url_input}"
+        job_id = job_queue.submit("urls", urls=[url_input], workspace=workspace)
     elif text_input:
-        text_data = text_input
-        source_name = "Raw Text Input"
-
-    if text_data:
-        chunks = [text_data[i:i+500] for i in range(0, len(text_data), 450)]
-        source_id = str(uuid.uuid4())
-        vs.add_texts(chunks, source_id)
-
-        st.session_state.sources.append({
-            "id": source_id,
-            "name": source_name,
-            "checked": True
-        })
+        job_id = job_queue.submit("text", text=text_input, name="Raw Text Input", workspace=workspace)
 
-        st.sidebar.success("✅ Added to Knowledge Base!")
+    if job_id:
+        st.sidebar.info(f"⏳ Queued job #{job_id}.")
     else:
         st.sidebar.warning("⚠️ Could not load any content.")
 
+# Anyone with the page open could read server files back through chat, so
+# folders can only be imported from under INGEST_ROOT (or with cli.py ingest)
+INGEST_ROOT = os.environ.get("INGEST_ROOT")
+if INGEST_ROOT:
+    with st.sidebar.expander("📁 Bulk import a folder"):
+        folder_input = st.text_input(f"Folder under {INGEST_ROOT}")
+        if st.button("📥 Import Folder"):
+            root = os.path.realpath(INGEST_ROOT)
+            folder = os.path.realpath(os.path.join(root, folder_input))
+            if os.path.commonpath([root, folder]) != root:
+                st.warning(f"⚠️ Only folders under {INGEST_ROOT} can be imported.")
+            elif not os.path.isdir(folder):
+                st.warning("⚠️ Folder not found.")
+            else:
+                job_id = job_queue.submit("directory", path=folder, workspace=workspace)
+                st.info(f"⏳ Queued job #{job_id}.")
+
+with st.sidebar.expander("🔗 Bulk import a reading list"):
+    reading_list = st.text_area("One URL or YouTube link per line")
+    if st.button("📥 Import Links"):
+        urls = [line.strip() for line in reading_list.splitlines() if line.strip()]
+        if urls:
+            job_id = job_queue.submit("urls", urls=urls, workspace=workspace)
+            st.info(f"⏳ Queued job #{job_id}.")
+
+JOB_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+
+def show_jobs():
+    jobs = job_queue.recent(5, workspace=workspace)
+    if not jobs:
+        return
+    st.markdown("### 🛠️ Ingestion Jobs")
+    for job in jobs:
+        label = f"{JOB_ICONS[job['status']]} #{job['id']} {job['kind']} · {job['docs_done']}/{job['docs_total']} docs · {job['chunks_done']} chunks"
+        if job["status"] in ("running", "done") and job["elapsed"]:
+            label += f" · {job['docs_per_s']:.2f} docs/s · {job['chunks_per_s']:.0f} chunks/s"
+        st.caption(label)
+        if job["status"] == "running" and job["docs_total"]:
+            st.progress(min(job["docs_done"] / job["docs_total"], 1.0))
+        if job["error"]:
+            st.caption(f"⚠️ {job['error']}")
+    # Refresh the whole page when a job finishes so its sources show up below
+    finished = {job["id"] for job in jobs if job["status"] in ("done", "failed")}
+    if "seen_jobs" not in st.session_state:
+        st.session_state.seen_jobs = finished
+    elif finished - st.session_state.seen_jobs:
+        st.session_state.seen_jobs |= finished
+        st.rerun()
+
+if hasattr(st, "fragment"):
+    # Poll job status every couple of seconds without rerunning the rest of the app
+    show_jobs = st.fragment(run_every=2)(show_jobs)
+with st.sidebar:
+    show_jobs()
+    if not hasattr(st, "fragment"):
+        st.button("🔄 Refresh jobs")
+
 # --- Sidebar: List Existing Sources ---
 st.sidebar.markdown("### 📚 Your Knowledge Base")
-for source in st.session_state.sources:
-    source["checked"] = st.sidebar.checkbox(
+sources = vs.registry.list()
+for source in sources:
+    check_col, delete_col = st.sidebar.columns([5, 1])
+    checked = check_col.checkbox(
         source["name"],
-        value=source["checked"],
-        key=f"checkbox_{source['name']}_{source.get('id', '')}"
+        value=source["id"] not in st.session_state.unchecked,
+        key=f"checkbox_{source['id']}"
     )
+    if checked:
+        st.session_state.unchecked.discard(source["id"])
+    else:
+        st.session_state.unchecked.add(source["id"])
+    if delete_col.button("🗑️", key=f"delete_{source['id']}", help="Remove this source"):
+        vs.delete_source(source["id"])
+        st.rerun()
+
+if vs.dead_rows and st.sidebar.button(f"🧹 Compact knowledge base ({vs.dead_rows} stale chunks)"):
+    # Runs on the job worker; the knowledge base stays searchable while it rebuilds
+    job_id = job_queue.submit("rebuild", workspace=workspace)
+    st.sidebar.info(f"⏳ Queued job #{job_id}.")
+
+regenerate = st.sidebar.checkbox("♻️ Regenerate answers (skip cache)", value=False)
+show_timings = st.sidebar.checkbox("🐞 Show latency breakdown", value=False)
 
 # --- Calculate allowed knowledge sources ---
-allowed_ids = [src["id"] for src in st.session_state.sources if src.get("checked", False)]
+allowed_ids = [src["id"] for src in sources if src["id"] not in st.session_state.unchecked]
+
+def format_stream(text):
+    """Render a partially streamed answer, quoting the <think> part like the final message does."""
+    if "<think>" not in text:
+        return text
+    before, _, rest = text.partition("<think>")
+    think, _, answer = rest.partition("</think>")
+    quoted = "\n> ".join(think.strip().splitlines())
+    return f"{before}> 💭 **SmartBuddy Thinking:**\n>\n> {quoted}\n\n{answer.strip()}"
+
 # --- Chat UI Begins Here ---
 st.subheader("💬 Chat With Your Knowledge Base")
 
@@ -84,7 +216,7 @@ if "user_input" not in st.session_state:
 if "user_input_ready" not in st.session_state:
     st.session_state["user_input_ready"] = False
 
-if st.session_state.sources:
+if sources:
     user_input = st.chat_input("Ask something...")
 
     if user_input:  # User just typed something
@@ -103,69 +235,66 @@ if st.session_state.sources:
         if user_input and user_input.strip():
             st.chat_message("user").markdown(user_input)
             st.session_state.chat_history.append(("user", user_input))
+            st.session_state.memory.add("user", user_input)
 
             if not allowed_ids:
                 st.warning("⚠️ Please select at least one knowledge source.")
             else:
-                with st.spinner("🔍 Retrieving relevant information..."):
-                    retrieved_chunks = vs.query(user_input, k=7, allowed_sources=allowed_ids)
-
-                context = "\n".join(chunk['chunk'] for chunk in retrieved_chunks[:3])
-
-                # Add recent chat history as memory context
-                history_limit = 3
-                memory_context = ""
-                for role, msg in st.session_state.chat_history[-history_limit * 2:]:
-                    if role == "user":
-                        memory_context += f"User: {msg}\n"
-                    else:
-                        memory_context += f"Assistant: {msg}\n"
-
-                # Create prompt for DeepSeek
-                prompt = f"""You are a helpful assistant.
-
-Here is the recent conversation:
-{memory_context}
-
-Use the following knowledge context to answer the user's question:
-{context}
-
-Current Question: {user_input}
-Answer:"""
-
-                with st.expander("🔍 Show Retrieved Context"):
-                    st.markdown(context)
-
-                with st.spinner("🧠 SmartBuddy is thinking..."):
-                    response = call_deepseek(prompt)
-
-                full_response = response.get("full", "").strip()
-                code_response = response.get("code")
-                code_response = code_response.strip() if code_response else ""
-
-                think_match = re.search(r"<think>(.*?)</think>", full_response, re.DOTALL)
-                think_text = think_match.group(1).strip() if think_match else ""
-
-                full_response = re.sub(r"<think>.*?</think>", "", full_response, flags=re.DOTALL).strip()
-
-                formatted_think = ""
-                if think_text:
-                    formatted_think = f"> 💭 **SmartBuddy Thinking:**\n>\n> " + "\n> ".join(think_text.splitlines())
-
-                formatted_code = ""
-                if code_response:
-                    formatted_code = f"\n\n### Code:\n```python\n{code_response}\n```"
-
-                final_message = ""
-                if formatted_think:
-                    final_message += formatted_think + "\n\n"
-                final_message += full_response if full_response else "⚠️ No answer returned."
-                final_message += formatted_code
-
-                st.session_state.chat_history.append(("assistant", final_message))
-
-                with st.chat_message("assistant"):
-                    st.markdown(final_message)
+                with metrics.turn() as trace:
+                    with st.spinner("🔍 Retrieving relevant information..."):
+                        retrieved_chunks = vs.query(user_input, k=7, allowed_sources=allowed_ids, mode="hybrid")
+
+                    # Fit the best chunks and a compressed history into a fixed token budget
+                    prompt, context_ids = build_chat_prompt(user_input, retrieved_chunks, st.session_state.memory)
+                    context = "\n\n".join(chunk['chunk'] for chunk in retrieved_chunks if chunk['id'] in context_ids)
+
+                    with st.expander("🔍 Show Retrieved Context"):
+                        st.markdown(context)
+
+                    with st.chat_message("assistant"):
+                        placeholder = st.empty()
+                        placeholder.markdown("🧠 SmartBuddy is thinking...")
+                        streamed = ""
+                        try:
+                            # Show tokens as they arrive; a rerun or Stop closes the stream and Ollama stops
+                            for token in cached_stream(prompt, context_ids, regenerate, cache_dir=vs.directory):
+                                streamed += token
+                                placeholder.markdown(format_stream(streamed))
+                            response = split_response(streamed.strip())
+                        except (OllamaError, requests.RequestException) as e:
+                            response = {"full": f"⚠️ Error occurred while retrieving the response. ({e})", "code": None}
+
+                    full_response = response.get("full", "").strip()
+                    code_response = response.get("code")
+                    code_response = code_response.strip() if code_response else ""
+
+                    think_match = re.search(r"<think>(.*?)</think>", full_response, re.DOTALL)
+                    think_text = think_match.group(1).strip() if think_match else ""
+
+                    full_response = re.sub(r"<think>.*?</think>", "", full_response, flags=re.DOTALL).strip()
+
+                    formatted_think = ""
+                    if think_text:
+                        formatted_think = f"> 💭 **SmartBuddy Thinking:**\n>\n> " + "\n> ".join(think_text.splitlines())
+
+                    formatted_code = ""
+                    if code_response:
+                        formatted_code = f"\n\n### Code:\n```python\n{code_response}\n```"
+
+                    final_message = ""
+                    if formatted_think:
+                        final_message += formatted_think + "\n\n"
+                    final_message += full_response if full_response else "⚠️ No answer returned."
+                    final_message += formatted_code
+
+                    placeholder.markdown(final_message)
+                    st.session_state.chat_history.append(("assistant", final_message))
+                    # Memory gets the answer without the thinking, so later prompts don't carry it
+                    st.session_state.memory.add("assistant", full_response + formatted_code)
+
+                if show_timings:
+                    with st.expander(f"🐞 Latency breakdown ({(time.perf_counter() - trace.start) * 1000:.0f} ms)"):
+                        st.table(trace.rows())
 
         # ✅ Reset the flag after processing
         st.session_state.user_input_ready = False
@@ -177,6 +306,7 @@ else:
 # --- Optional Clear Button ---
 if st.button("🗑️ Clear Chat"):
     st.session_state.chat_history = []
+    st.session_state.memory = ConversationMemory()
 
 # --- Tools Panel for Mindmap, Flashcards, Quiz, Summary, Key Points ---
 st.sidebar.header("🔧 Smart Tools")
@@ -184,6 +314,9 @@ st.sidebar.header("🔧 Smart Tools")
 if "flashcards" not in st.session_state:
     st.session_state.flashcards = []
 
+FLASHCARD_COUNT = 10
+QUIZ_COUNT = 10
+
 st.sidebar.header("🎴 Flashcards:")
 flashcard_topic = st.sidebar.text_input("Enter topic/question for Flashcards", key="flashcard_topic")
 
@@ -194,69 +327,44 @@ if st.sidebar.button("🔖 Generate Flashcards"):
         st.sidebar.warning("⚠️ Please select at least one knowledge source.")
     else:
         with st.spinner("🔍 Retrieving context for flashcards..."):
-            retrieved_chunks = vs.query(flashcard_topic, k=7, allowed_sources=allowed_ids)
+            retrieved_chunks = vs.query(flashcard_topic, k=7, allowed_sources=allowed_ids, mode="hybrid")
 
             if not retrieved_chunks:
                 st.sidebar.warning("⚠️ No relevant content found in the knowledge base.")
             else:
-                context = "\n".join([chunk['chunk'] for chunk in retrieved_chunks[:3]])
-                flashcard_prompt = f"""
-                Generate 10 flashcards based ONLY on the following context:
-
-                {context}
-
-                Format strictly as:
-                Question: ...
-                Answer: ...
-
-                Separate each flashcard with a double newline.
-                """
-
-                flashcard_response = call_deepseek(flashcard_prompt)
-                output = flashcard_response.get("full", "").strip()
-
-                # Clean out <think> sections if present
-                output = re.sub(r"<think>.*?</think>", "", output, flags=re.DOTALL).strip()
-
-                # Parse flashcards
-                flashcards_raw = re.split(r'\n{2,}', output)
+                parts, counts = context_parts(retrieved_chunks, FLASHCARD_COUNT)
+                progress = st.sidebar.progress(0.0, text="🎴 Generating flashcards...")
                 flashcards = []
-
-                for card in flashcards_raw:
-                    q_match = re.search(r"Question:\s*(.+)", card, re.IGNORECASE)
-                    a_match = re.search(r"Answer:\s*(.+)", card, re.IGNORECASE)
-                    if q_match and a_match:
-                        flashcards.append({
-                            "question": q_match.group(1).strip(),
-                            "answer": a_match.group(1).strip()
-                        })
-
-                if flashcards:
-                    
-                    pastel_colors = ["#fef3c7", "#d1fae5", "#e0e7ff", "#fee2e2", "#f3e8ff"]  # soft, vibrant colors
-
-                    for i, card in enumerate(flashcards):
-                        bg_color = pastel_colors[i % len(pastel_colors)]
-                        flashcard_html = f"""
-                        <div style="
-                            background-color: {bg_color};
-                            border-radius: 12px;
-                            padding: 16px;
-                            margin-bottom: 15px;
-                            box-shadow: 2px 2px 10px rgba(0, 0, 0, 0.05);
-                            transition: transform 0.2s;
-                            font-family: 'Segoe UI', sans-serif;
-                        ">
-                            <p style="font-weight: bold; margin-top: 0; color: #1f2937;">🧠 Question:</p>
-                            <p style="margin-bottom: 10px; color: #111827;">{card['question']}</p>
-                            <details style="color: #065f46;">
-                                <summary style="cursor: pointer; font-weight: 600;"></summary>
-                                <p style="margin-top: 10px;"><strong>Answer:</strong> {card['answer']}</p>
-                            </details>
-                        </div>
-                        """
-                        st.markdown(flashcard_html, unsafe_allow_html=True)
-                else:
+                pastel_colors = ["#fef3c7", "#d1fae5", "#e0e7ff", "#fee2e2", "#f3e8ff"]  # soft, vibrant colors
+
+                # Cards are rendered as each parallel request comes back
+                for card in generate("flashcards", parts, counts, regenerate, cache_dir=vs.directory):
+                    bg_color = pastel_colors[len(flashcards) % len(pastel_colors)]
+                    flashcards.append(card)
+                    progress.progress(min(len(flashcards) / FLASHCARD_COUNT, 1.0),
+                                      text=f"🎴 {len(flashcards)}/{FLASHCARD_COUNT} flashcards")
+                    flashcard_html = f"""
+                    <div style="
+                        background-color: {bg_color};
+                        border-radius: 12px;
+                        padding: 16px;
+                        margin-bottom: 15px;
+                        box-shadow: 2px 2px 10px rgba(0, 0, 0, 0.05);
+                        transition: transform 0.2s;
+                        font-family: 'Segoe UI', sans-serif;
+                    ">
+                        <p style="font-weight: bold; margin-top: 0; color: #1f2937;">🧠 Question:</p>
+                        <p style="margin-bottom: 10px; color: #111827;">{html.escape(card['question'])}</p>
+                        <details style="color: #065f46;">
+                            <summary style="cursor: pointer; font-weight: 600;"></summary>
+                            <p style="margin-top: 10px;"><strong>Answer:</strong> {html.escape(card['answer'])}</p>
+                        </details>
+                    </div>
+                    """
+                    st.markdown(flashcard_html, unsafe_allow_html=True)
+                progress.empty()
+
+                if not flashcards:
                     st.sidebar.warning("⚠️ Could not parse any flashcards properly.")
                     
 # Sidebar Header
@@ -266,83 +374,63 @@ quiz_question = st.sidebar.text_input("💬 Enter quiz topic or question", key="
 
 if st.sidebar.button("🎯 Generate Quiz"):
     with st.spinner("🔍 Searching for relevant content..."):
-        retrieved_chunks = vs.query(quiz_question, k=7, allowed_sources=allowed_ids)
+        retrieved_chunks = vs.query(quiz_question, k=7, allowed_sources=allowed_ids, mode="hybrid")
 
         if not retrieved_chunks:
             st.warning("⚠️ No relevant content found. Please try a different query.")
         else:
+            context, context_ids = build_context(retrieved_chunks)
             with st.expander("🧾 Preview Retrieved Context"):
-                for idx, chunk in enumerate(retrieved_chunks[:3], 1):
+                used_chunks = [chunk for chunk in retrieved_chunks if chunk['id'] in context_ids]
+                for idx, chunk in enumerate(used_chunks, 1):
                     st.markdown(f"**Chunk {idx}:** {chunk['chunk']}")
 
-            context = "\n".join([chunk['chunk'] for chunk in retrieved_chunks[:3]])
-            quiz_prompt = f"""
-            Create a quiz consisting of 10 multiple-choice questions based ONLY on the following context:
-            {context}
-            - For each question, provide 4 possible answers.
-            - Clearly indicate the correct answer using '(Correct Answer)'.
-            """
-
-            quiz_response = call_deepseek(quiz_prompt)
-
-            if 'full' in quiz_response:
-                cleaned_quiz_data = re.sub(r'<think>.*?</think>', '', quiz_response['full'], flags=re.DOTALL)
-
-                st.markdown("<h2 style='text-align:center;'>📋 Your AI-Generated Quiz</h2><hr>", unsafe_allow_html=True)
-
-                # Custom CSS
-                st.markdown("""
-                    <style>
-                        .quiz-card {
-                            background: linear-gradient(135deg, #f0f4ff, #dbe7ff);
-                            border-radius: 16px;
-                            padding: 20px;
-                            margin-bottom: 25px;
-                            box-shadow: 2px 4px 10px rgba(0,0,0,0.07);
-                        }
-                        .question-text {
-                            font-size: 18px;
-                            font-weight: bold;
-                            color: #1a1a1a;
-                            margin-bottom: 10px;
-                        }
-                        .option {
-                            margin-left: 15px;
-                            margin-bottom: 6px;
-                            padding: 6px 10px;
-                            border-radius: 8px;
-                            background-color: #fff;
-                            border: 1px solid #ddd;
-                        }
-                    </style>
-                """, unsafe_allow_html=True)
-
-                # Parse and display quiz
-                quiz_blocks = re.split(r'\n(?=\d+\.)', cleaned_quiz_data.strip())
-
-                for i, block in enumerate(quiz_blocks):
-                    lines = block.strip().split('\n')
-                    if not lines:
-                        continue
-
-                    question_text = re.sub(r"\*\*(.*?)\*\*", r"\1", lines[0]).strip()
-                    options = []
-
-                    for line in lines[1:]:
-                        clean_line = re.sub(r'\(Correct Answer\)', '', line).replace('-', '').strip()
-                        if clean_line:
-                            options.append(clean_line)
-
-                    options_html = "".join([f"<div class='option'>{opt}</div>" for opt in options])
-
-                    card_html = f""" 
-                    <div class='quiz-card'>
-                        <div class='question-text'>{question_text}</div>
-                        {options_html}
-                    </div>"""
-
-                    st.markdown(card_html, unsafe_allow_html=True)
-
+            st.markdown("<h2 style='text-align:center;'>📋 Your AI-Generated Quiz</h2><hr>", unsafe_allow_html=True)
+
+            # Custom CSS
+            st.markdown("""
+                <style>
+                    .quiz-card {
+                        background: linear-gradient(135deg, #f0f4ff, #dbe7ff);
+                        border-radius: 16px;
+                        padding: 20px;
+                        margin-bottom: 25px;
+                        box-shadow: 2px 4px 10px rgba(0,0,0,0.07);
+                    }
+                    .question-text {
+                        font-size: 18px;
+                        font-weight: bold;
+                        color: #1a1a1a;
+                        margin-bottom: 10px;
+                    }
+                    .option {
+                        margin-left: 15px;
+                        margin-bottom: 6px;
+                        padding: 6px 10px;
+                        border-radius: 8px;
+                        background-color: #fff;
+                        border: 1px solid #ddd;
+                    }
+                </style>
+            """, unsafe_allow_html=True)
+
+            parts, counts = context_parts(retrieved_chunks, QUIZ_COUNT)
+            questions = 0
+            # Questions are rendered as each parallel request comes back
+            for item in generate("quiz", parts, counts, regenerate, cache_dir=vs.directory):
+                questions += 1
+                options_html = "".join([f"<div class='option'>{html.escape(str(opt))}</div>" for opt in item["options"]])
+
+                card_html = f"""
+                <div class='quiz-card'>
+                    <div class='question-text'>{questions}. {html.escape(item['question'])}</div>
+                    {options_html}
+                    <details><summary>Show answer</summary>✅ {html.escape(str(item['answer']))}</details>
+                </div>"""
+
+                st.markdown(card_html, unsafe_allow_html=True)
+
+            if questions:
                 st.success("✅ Quiz successfully generated!")
             else:
                 st.warning("⚠️ Failed to generate quiz. Try again or check your API.")
@@ -358,44 +446,24 @@ if st.sidebar.button("📌 Generate Key Points"):
         st.sidebar.warning("⚠️ Please enter some text to generate key points.")
     else:
         with st.spinner("🔍 Analyzing text..."):
-            keypoints_prompt = f"""Generate concise and impactful key points from the following text, EXCLUDE any content within <think> tags. Ensure that each key point clearly explains a distinct concept .:\n\n{key_points_input}"""            
-            keypoints_response = call_deepseek(keypoints_prompt)
-
-            if 'full' in keypoints_response:
-                key_points_output = keypoints_response['full'].strip()
-                # Remove any <think> tags and their content from the final output
-                key_points_output = re.sub(r"<think>.*?</think>", "", key_points_output, flags=re.DOTALL).strip()
-                if key_points_output:
-                    # Show the key points result on the main page (chat page)
+            parts, counts = text_parts(key_points_input)
+            points = 0
+            # Long text is split into parts summarized in parallel; points show as each part returns
+            for item in generate("key_points", parts, counts, regenerate, cache_dir=vs.directory):
+                if not points:
                     st.markdown("""
                         <div style="text-align: center;">
                             <h3>✨ Key Points</h3>
                         </div>
                     """, unsafe_allow_html=True)
                     st.subheader("📝 Key Points:")
-                    key_points_list = [point.strip() for point in key_points_output.splitlines() if point.strip()]
-                    for i,point in enumerate(key_points_list):
-                        # Clean up leading number if present like "1. Framing: ..."
-                        point = re.sub(r"^\d+\.\s*", "", point)
-                        # Emphasize first word before colon as title if applicable
-                        if ':' in point:
-                            title, desc = point.split(':', 1)
-                            st.markdown(f"- 💡 **{title.strip()}**: {desc.strip()}")
-                        else:
-                            st.markdown(f"- 💡 {point}")
-                        
-                else:
-                    st.info("No key points were generated after filtering.")
-            else:
+                points += 1
+                st.markdown(f"- 💡 **{item['title'].strip()}**: {item['point'].strip()}")
+            if not points:
                 st.error("Failed to generate key points.")
 
-def save_note_to_file(text):
-    """Save the recognized text as a note in a markdown file."""
-    with open("notes.md", "a") as file:
-        file.write(f"### Note:\n{text}\n\n")
-
 def record_note():
-    """Record voice, convert it to text and display in the Streamlit interface."""
+    """Record voice, transcribe it, and save it as a note that becomes searchable from chat."""
     recognizer = sr.Recognizer()
     mic = sr.Microphone()
 
@@ -405,15 +473,18 @@ def record_note():
             recognizer.adjust_for_ambient_noise(source)
             audio = recognizer.listen(source)
 
-            # Use Google's Web Speech API for recognizing speech
-            text = recognizer.recognize_google(audio)
-            st.success(f"Recognized: {text}")
+        text = transcribe(recognizer, audio, transcriber)
+        if not text:
+            st.error("Sorry, I could not understand your speech.")
+            return
+        st.success(f"Recognized: {text}")
 
-            # Display the recognized text in the Streamlit app
-            st.sidebar.text_area("Your Note", value=text, height=150)
+        # Display the recognized text in the Streamlit app
+        st.sidebar.text_area("Your Note", value=text, height=150)
 
-            # Save the note to markdown file
-            save_note_to_file(text)
+        # Saved notes are embedded in the background, a few seconds after the last one
+        note_store.add(text, transcriber)
+        note_indexer.schedule()
 
     except sr.UnknownValueError:
         st.error("Sorry, I could not understand your speech.")
@@ -421,8 +492,13 @@ def record_note():
         st.error(f"Could not request results; {e}")
 
 # Streamlit interface
-st.sidebar.button("Voice Notes App")
-
+st.sidebar.header("🎙️ Voice Notes")
+transcriber = st.sidebar.selectbox("Transcriber", list(TRANSCRIBERS), index=list(TRANSCRIBERS).index(TRANSCRIBER),
+                                   help="sphinx and vosk run offline")
 
 if st.sidebar.button("Record Note"):
-    record_note()
\ No newline at end of file
+    record_note()
+
+with st.sidebar.expander(f"🗒️ Recent notes ({note_store.count()})"):
+    for note in note_store.recent(5):
+        st.caption(f"{time.strftime('%b %d %H:%M', time.localtime(note['created']))} · {note['text']}")
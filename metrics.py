@@ -0,0 +1,140 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+log = logging.getLogger("smartbuddy.metrics")
+
+_lock = threading.Lock()
+_counters = {}  # name -> total
+_timings = {}  # name -> [count, sum, per-bucket counts]
+_trace = contextvars.ContextVar("trace", default=None)
+_server = None
+
+
+class Trace:
+    """Spans and counters recorded while a turn() block is active on this thread."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []  # (name, offset s, duration s), in completion order
+        self.counters = {}
+
+    def rows(self):
+        """Table rows for the debug panel: spans first, then counters."""
+        rows = [{"step": name, "start_ms": round(offset * 1000, 1), "ms": round(duration * 1000, 1)}
+                for name, offset, duration in sorted(self.spans, key=lambda s: s[1])]
+        rows += [{"step": name, "count": value} for name, value in sorted(self.counters.items())]
+        return rows
+
+    def total(self, prefix=""):
+        return sum(d for name, _, d in self.spans if name.startswith(prefix))
+
+
+def observe(name, seconds):
+    """Record one duration under name (what span() does when it exits)."""
+    with _lock:
+        timing = _timings.setdefault(name, [0, 0.0, [0] * len(BUCKETS)])
+        timing[0] += 1
+        timing[1] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                timing[2][i] += 1
+                break
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append((name, time.perf_counter() - seconds - trace.start, seconds))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(json.dumps({"span": name, "ms": round(seconds * 1000, 3)}))
+
+
+def incr(name, n=1):
+    if not n:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    trace = _trace.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + n
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(json.dumps({"counter": name, "n": n}))
+
+
+@contextmanager
+def span(name):
+    """Time the with-block under name."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t)
+
+
+@contextmanager
+def turn():
+    """Collect every span and counter recorded on this thread into a Trace."""
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters), {name: (t[0], t[1], list(t[2])) for name, t in _timings.items()}
+
+
+def _metric_name(name):
+    return "smartbuddy_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text():
+    """All counters and timings in the Prometheus text exposition format."""
+    counters, timings = snapshot()
+    lines = []
+    for name, value in sorted(counters.items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, (count, total, buckets) in sorted(timings.items()):
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(BUCKETS, buckets):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'{metric}_bucket{{le="+Inf"}} {count}', f"{metric}_sum {total:.6f}", f"{metric}_count {count}"]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics for Prometheus on a background thread (once per process)."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
@@ -1,31 +1,144 @@
-import subprocess
+import json
+import os
 import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+from llm_cache import get_response_cache
 
-def call_deepseek(prompt):
+MODEL = "deepseek-r1:latest"
+KEEP_ALIVE = "30m"  # how long Ollama keeps the model loaded after a request; -1 pins it
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 300  # longest silence allowed between streamed chunks (covers model load)
+
+_session = None
+_session_lock = threading.Lock()
+_preloaded = set()
+
+
+class OllamaError(Exception):
+    pass
+
+
+def ollama_url(path):
+    host = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+    if "://" not in host:
+        host = "http://" + host
+    return host.rstrip("/") + path
+
+
+def get_session():
+    """One keep-alive connection pool shared by every call in the process."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+            _session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        return _session
+
+
+def stream_deepseek(prompt, model=MODEL, cancel=None, keep_alive=KEEP_ALIVE,
+                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+    """Yield response text as Ollama generates it.
+
+    Setting the `cancel` threading.Event (or closing the generator) drops the
+    connection, which makes Ollama stop generating. Raises OllamaError if the
+    stream ends without Ollama's final "done" message.
+    """
+    payload = {"model": model, "prompt": prompt, "stream": True, "keep_alive": keep_alive}
+    start = time.perf_counter()
+    first = True
     try:
-        result = subprocess.run(
-            ["ollama", "run", "deepseek-r1:latest"],
-            input=prompt,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            check=True  # Ensures an exception is raised for non-zero exit code
-        )
-
-        response = result.stdout.strip()
-
-        # Print full response for debugging
-        print("\n🔍 Full DeepSeek Response:\n", response)
-
-        # Optional: extract code block if it exists (matching any language)
-        code_match = re.search(r"```(.*?)```", response, re.DOTALL)
-        if code_match:
-            code = code_match.group(1).strip()
-            return {"full": response, "code": code}
-        else:
-            return {"full": response, "code": None}
-    
-    except subprocess.CalledProcessError as e:
+        with get_session().post(ollama_url("/api/generate"), json=payload, stream=True, timeout=timeout) as r:
+            if r.status_code != 200:
+                raise OllamaError(f"{r.status_code}: {r.text.strip()}")
+            for line in r.iter_lines():
+                if cancel is not None and cancel.is_set():
+                    return
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise OllamaError(data["error"])
+                if data.get("response"):
+                    if first:
+                        metrics.observe("llm.first_token", time.perf_counter() - start)
+                        first = False
+                    yield data["response"]
+                if data.get("done"):
+                    metrics.incr("llm.prompt_tokens", data.get("prompt_eval_count", 0))
+                    metrics.incr("llm.tokens", data.get("eval_count", 0))
+                    return
+            # Ollama crashed or the connection dropped mid-answer
+            raise OllamaError("Response stream ended before the answer was complete")
+    finally:
+        metrics.observe("llm.generate", time.perf_counter() - start)
+
+
+def cached_stream(prompt, chunk_ids=(), regenerate=False, model=MODEL, cancel=None, cache_dir=".", **kwargs):
+    """stream_deepseek() backed by the response cache.
+
+    A cache hit is yielded in one piece; a miss is streamed and stored only
+    once it completes (not if it's cancelled or fails part way). chunk_ids are the retrieved chunks the prompt was built from.
+    regenerate=True skips the lookup and overwrites the cached answer.
+    cache_dir is the directory of the store the chunks came from.
+    """
+    cache = get_response_cache(cache_dir)
+    key = cache.key(model, prompt, chunk_ids)
+    if not regenerate:
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.incr("llm.cache_hits")
+            yield cached
+            return
+    metrics.incr("llm.cache_misses")
+    parts = []
+    for token in stream_deepseek(prompt, model=model, cancel=cancel, **kwargs):
+        parts.append(token)
+        yield token
+    # stream_deepseek raises on an incomplete stream and returns early when cancelled
+    if cancel is None or not cancel.is_set():
+        cache.put(key, "".join(parts), chunk_ids)
+
+
+def preload_model(model=MODEL, keep_alive=KEEP_ALIVE):
+    """Ask Ollama to load the model now (in the background) so the first question doesn't wait for it.
+
+    Only the first call per process and model does anything.
+    """
+    with _session_lock:
+        if model in _preloaded:
+            return
+        _preloaded.add(model)
+
+    def load():
+        try:
+            get_session().post(ollama_url("/api/generate"), json={"model": model, "keep_alive": keep_alive},
+                               timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except requests.RequestException:
+            pass  # the first real request will surface the problem
+    threading.Thread(target=load, daemon=True).start()
+
+
+def split_response(response):
+    # Optional: extract code block if it exists (matching any language)
+    code_match = re.search(r"```(.*?)```", response, re.DOTALL)
+    if code_match:
+        code = code_match.group(1).strip()
+        return {"full": response, "code": code}
+    else:
+        return {"full": response, "code": None}
+
+
+def call_deepseek(prompt, chunk_ids=(), regenerate=False, **kwargs):
+    try:
+        response = "".join(cached_stream(prompt, chunk_ids, regenerate, **kwargs)).strip()
+        return split_response(response)
+
+    except (OllamaError, requests.RequestException) as e:
         print(f"Error calling DeepSeek: {e}")
         return {"full": "⚠️ Error occurred while retrieving the response.", "code": None}
     except Exception as e:
@@ -0,0 +1,148 @@
+"""ONNX Runtime path for the sentence-transformers embedding model.
+
+    pip install -r requirements-onnx.txt
+    python onnx_encoder.py                      # export all-MiniLM-L6-v2 (int8) to onnx_models/
+    EMBEDDING_ENCODER=onnx streamlit run main.py
+
+The transformer is exported once, by running this script, and dynamically
+quantized to int8, which runs several times faster than PyTorch on CPU; the
+app never exports on its own. Export also saves reference embeddings from the
+PyTorch model; every load re-encodes the same texts and refuses the ONNX
+model unless they still match (cosine >= MIN_COSINE). Needs the optional
+packages in requirements-onnx.txt (onnx, onnxruntime and, for exporting with
+recent PyTorch, onnxscript).
+"""
+import argparse
+import json
+import os
+import numpy as np
+
+ONNX_DIR = "onnx_models"
+MIN_COSINE = 0.99
+VALIDATION_TEXTS = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The mitochondria is the powerhouse of the cell.",
+    "def binary_search(items, target): return bisect.bisect_left(items, target)",
+    "Newton's second law states that force equals mass times acceleration.",
+    "The French Revolution began in 1789 with the storming of the Bastille.",
+    "Gradient descent updates parameters in the direction of the negative gradient.",
+    "A linked list stores elements in nodes that point to the next node.",
+    "Supply and demand determine the market price of a good.",
+    "Voice note: remember to revise chapter four before Friday's quiz.",
+    "SELECT name, COUNT(*) FROM students GROUP BY name HAVING COUNT(*) > 1;",
+    "Overfitting happens when a model memorizes the training data instead of generalizing.",
+    "Water boils at 100 degrees Celsius at sea level.",
+]
+
+
+def model_dir(name):
+    return os.path.join(ONNX_DIR, name.replace("/", "__"))
+
+
+class OnnxEncoder:
+    """Drop-in for the parts of SentenceTransformer the app uses: encode() and .tokenizer."""
+
+    def __init__(self, directory, threads=None):
+        import onnxruntime
+        from transformers import AutoTokenizer
+        with open(os.path.join(directory, "config.json")) as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(directory, self.config["file"]), options,
+                                                    providers=["CPUExecutionProvider"])
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        out = np.zeros((len(texts), self.config["dim"]), dtype="float32")
+        # Similar lengths batched together pad less
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                   max_length=self.config["max_seq_length"], return_tensors="np")
+            feeds = {name: batch[name].astype("int64") for name in self._inputs if name in batch}
+            if "token_type_ids" in self._inputs and "token_type_ids" not in feeds:
+                feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+            hidden = self.session.run(None, feeds)[0]
+            # Mean pooling over real tokens, as the sentence-transformers Pooling layer does
+            mask = batch["attention_mask"][..., None].astype("float32")
+            out[rows] = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+
+def export_onnx(name, quantize=True):
+    """Export a sentence-transformers model to onnx_models/<name>/ and save reference embeddings."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(name, device="cpu")
+    directory = model_dir(name)
+    os.makedirs(directory, exist_ok=True)
+    sample = model.tokenizer(["an example sentence"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        # The transformer also returns pooler_output, which mean pooling doesn't use
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            if token_type_ids is None:
+                return self.transformer(input_ids=input_ids, attention_mask=attention_mask)[0]
+            return self.transformer(input_ids=input_ids, attention_mask=attention_mask,
+                                    token_type_ids=token_type_ids)[0]
+
+    axes = {n: {0: "batch", 1: "tokens"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "tokens"}
+    fp32_path = os.path.join(directory, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(LastHiddenState(model[0].auto_model.eval()), tuple(sample[n] for n in names),
+                          fp32_path, input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes=axes, opset_version=17)
+    file = "model.onnx"
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(directory, "model_int8.onnx"), weight_type=QuantType.QInt8)
+        file = "model_int8.onnx"
+    model.tokenizer.save_pretrained(directory)
+    config = {"model": name, "file": file, "dim": model.get_sentence_embedding_dimension(),
+              "max_seq_length": model.max_seq_length}
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    np.save(os.path.join(directory, "reference.npy"), model.encode(VALIDATION_TEXTS, normalize_embeddings=True))
+    return directory
+
+
+def validate(encoder, directory):
+    """Lowest cosine similarity between the encoder's and the reference embeddings."""
+    reference = np.load(os.path.join(directory, "reference.npy"))
+    embeddings = encoder.encode(VALIDATION_TEXTS, normalize_embeddings=True)
+    return float(np.min(np.sum(embeddings * reference, axis=1)))
+
+
+def load_onnx_model(name):
+    """Load and validate the ONNX encoder exported for a model by `python onnx_encoder.py`."""
+    directory = model_dir(name)
+    if not os.path.exists(os.path.join(directory, "config.json")):
+        raise FileNotFoundError(f"No ONNX export for {name}; run python onnx_encoder.py --model {name}")
+    encoder = OnnxEncoder(directory)
+    cosine = validate(encoder, directory)
+    if cosine < MIN_COSINE:
+        raise ValueError(f"ONNX embeddings differ from {name} (min cosine {cosine:.4f} < {MIN_COSINE})")
+    return encoder
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export an embedding model to ONNX and check it.")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--no-quantize", action="store_true", help="keep float32 weights")
+    args = parser.parse_args()
+    path = export_onnx(args.model, quantize=not args.no_quantize)
+    print(f"Exported to {path}, min cosine vs. PyTorch: {validate(OnnxEncoder(path), path):.4f}")
@@ -0,0 +1,122 @@
+import re
+import metrics
+from chunker import approx_token_counts, split_units
+from vector_store import clean_context
+
+# Token budgets (approximate, see approx_token_counts). Ollama's default context
+# is a few thousand tokens and the answer needs room too, so the prompt is kept
+# well under it; a bounded prompt also keeps prefill time flat as a chat grows.
+CONTEXT_TOKENS = 1200
+RECENT_TOKENS = 400  # verbatim recent turns
+SUMMARY_TOKENS = 200  # compressed older turns
+SUMMARY_SENTENCES = 1  # sentences kept per compressed message
+MIN_NEW_FRACTION = 0.3  # skip a chunk when less than this much of it is new text
+
+THINK_RE = re.compile(r"<think>.*?(</think>|$)", re.DOTALL)
+THINK_QUOTE_RE = re.compile(r"^> 💭 \*\*SmartBuddy Thinking:\*\*\n(?:>.*(?:\n|$))*", re.MULTILINE)
+
+
+def count_tokens(text):
+    return round(approx_token_counts([text])[0]) if text else 0
+
+
+def strip_think(text):
+    """Drop the model's reasoning, raw (<think>...</think>) or as rendered in the chat."""
+    text = THINK_RE.sub("", text)
+    return THINK_QUOTE_RE.sub("", text).strip()
+
+
+def _sentence_key(sentence):
+    return " ".join(re.findall(r"\w+", sentence.lower()))
+
+
+def build_context(chunks, budget=CONTEXT_TOKENS):
+    """Join retrieved chunks (best first) into at most `budget` tokens of context.
+
+    Chunks are cleaned with clean_context, and sentences already included from
+    a higher-ranked chunk (the overlap between neighbouring chunks, or the same
+    passage in two sources) are left out. Returns (context, ids of chunks used).
+    """
+    seen = set()
+    parts, ids = [], []
+    used = 0
+    for chunk in chunks:
+        sentences = [s for s, _ in split_units(chunk["chunk"])]
+        fresh = [s for s in sentences if _sentence_key(s) not in seen]
+        if not fresh or len(fresh) < MIN_NEW_FRACTION * len(sentences):
+            metrics.incr("prompt.chunks_duplicate")
+            continue
+        text = clean_context(" ".join(fresh))
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            metrics.incr("prompt.chunks_over_budget")
+            continue  # a shorter, lower-ranked chunk may still fit
+        seen.update(_sentence_key(s) for s in fresh)
+        parts.append(text)
+        ids.append(chunk["id"])
+        used += tokens
+    return "\n\n".join(parts), ids
+
+
+class ConversationMemory:
+    """Chat history for prompts, kept within a fixed token budget.
+
+    The latest turns are kept verbatim (without <think> reasoning). Older turns
+    are compressed, one at a time as they fall out of the recent window, into
+    a short extractive summary whose oldest lines are dropped past its budget.
+    Nothing is ever re-summarized, so each turn costs the same to add.
+    """
+
+    def __init__(self, recent_tokens=RECENT_TOKENS, summary_tokens=SUMMARY_TOKENS):
+        self.recent_tokens = recent_tokens
+        self.summary_tokens = summary_tokens
+        self.recent = []  # (role, text, tokens)
+        self.summary = []  # (line, tokens)
+
+    def add(self, role, text):
+        text = strip_think(text)
+        if not text:
+            return
+        self.recent.append((role, text, count_tokens(text)))
+        while len(self.recent) > 1 and sum(t for _, _, t in self.recent) > self.recent_tokens:
+            self._compress(*self.recent.pop(0)[:2])
+
+    def _compress(self, role, text):
+        sentences = [s for s, _ in split_units(text)][:SUMMARY_SENTENCES]
+        line = f"{'User' if role == 'user' else 'Assistant'}: {' '.join(sentences)}"
+        words = line.split()
+        if len(words) > 40:
+            line = " ".join(words[:40]) + " ..."
+        self.summary.append((line, count_tokens(line)))
+        while self.summary and sum(t for _, t in self.summary) > self.summary_tokens:
+            self.summary.pop(0)
+
+    def render(self, exclude_last_user=False):
+        """Summary lines, then recent turns, as prompt text."""
+        recent = self.recent
+        if exclude_last_user and recent and recent[-1][0] == "user":
+            recent = recent[:-1]  # the current question is added to the prompt separately
+        lines = [line for line, _ in self.summary]
+        if lines:
+            lines = ["(Earlier, summarized)"] + lines + ["(Recent)"]
+        lines += [f"{'User' if role == 'user' else 'Assistant'}: {text}" for role, text, _ in recent]
+        return "\n".join(lines)
+
+
+def build_chat_prompt(question, chunks, memory=None, context_tokens=CONTEXT_TOKENS):
+    """Prompt for one chat turn; returns (prompt, ids of the chunks it uses)."""
+    with metrics.span("prompt.build"):
+        context, ids = build_context(chunks, context_tokens)
+        history = memory.render(exclude_last_user=True) if memory else ""
+        # Fixed instructions first so Ollama can reuse the cached prompt prefix
+        prompt = "You are a helpful assistant.\n\n"
+        if history:
+            prompt += f"Here is the recent conversation:\n{history}\n\n"
+        prompt += f"""Use the following knowledge context to answer the user's question:
+{context}
+
+Current Question: {question}
+Answer:"""
+    metrics.incr("prompt.tokens", count_tokens(prompt))
+    metrics.incr("prompt.chunks_used", len(ids))
+    return prompt, ids
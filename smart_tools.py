@@ -0,0 +1,189 @@
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+import metrics
+from ollama_chat import OllamaError, cached_stream
+from prompting import build_context, count_tokens, strip_think
+
+WORKERS = 3  # parallel Ollama requests; set OLLAMA_NUM_PARALLEL at least this high
+ITEMS_PER_REQUEST = 2
+RETRIES = 2  # extra attempts for items whose output didn't parse
+KEY_POINT_PART_TOKENS = 300
+KEY_POINTS_PER_PART = 3
+
+TOOLS = {
+    "flashcards": {
+        "task": "Write {n} flashcards that test understanding of the context.",
+        "schema": '[{"question": "...", "answer": "..."}]',
+    },
+    "quiz": {
+        "task": "Write {n} multiple-choice quiz questions about the context, each with exactly 4 options.",
+        "schema": '[{"question": "...", "options": ["...", "...", "...", "..."], "answer": "<the correct option, copied exactly>"}]',
+    },
+    "key_points": {
+        "task": "Extract the {n} most important key points from the text, each explaining one distinct concept.",
+        "schema": '[{"title": "<2-5 words>", "point": "<one sentence>"}]',
+    },
+}
+
+
+def tool_prompt(tool, context, n, avoid=()):
+    spec = TOOLS[tool]
+    prompt = f"""{spec['task'].format(n=n)} Use ONLY the following context:
+
+{context}
+
+Respond with a JSON array of exactly {n} objects and nothing else, in this format:
+{spec['schema']}"""
+    if avoid:
+        prompt += "\n\nDo not repeat these:\n" + "\n".join(f"- {a}" for a in avoid)
+    return prompt
+
+
+def _normalize(item):
+    """item with scalar fields as strings (models often emit {"answer": 4}), or None if a field is nested.
+
+    Only a quiz's "options" may be a list, and then only of scalars.
+    """
+    if not isinstance(item, dict):
+        return None
+    fields = {}
+    for key, value in item.items():
+        if key == "options" and isinstance(value, list):
+            if any(isinstance(o, (dict, list)) for o in value):
+                return None
+            fields[key] = ["" if o is None else str(o) for o in value]
+        elif isinstance(value, (dict, list)):
+            return None
+        else:
+            fields[key] = "" if value is None else str(value)
+    return fields
+
+
+def _valid(tool, item):
+    if tool == "key_points":
+        return bool(item.get("title", "").strip() and item.get("point", "").strip())
+    if not item.get("question", "").strip() or not item.get("answer", "").strip():
+        return False
+    if tool == "quiz":
+        options = item.get("options")
+        return isinstance(options, list) and len(options) == 4 and item["answer"].strip() in options
+    return True
+
+
+def parse_items(tool, text):
+    """Valid items from a model response: a JSON array, possibly wrapped in prose or a code fence.
+
+    Falls back to parsing the individual {...} objects when the array as a
+    whole is malformed (e.g. truncated or missing a comma), so one bad item
+    doesn't lose the rest.
+    """
+    text = strip_think(text)
+    start, end = text.find("["), text.rfind("]")
+    items = None
+    if start != -1 and end > start:
+        try:
+            items = json.loads(text[start:end + 1])
+        except ValueError:
+            pass
+    if not isinstance(items, list):
+        items = []
+        for match in re.finditer(r"\{[^{}]*(?:\[[^\[\]]*\][^{}]*)?\}", text):
+            try:
+                items.append(json.loads(match.group(0)))
+            except ValueError:
+                continue
+    items = [_normalize(item) for item in items]
+    return [item for item in items if item is not None and _valid(tool, item)]
+
+
+def _item_key(tool, item):
+    text = item["title"] if tool == "key_points" else item["question"]
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def _request(tool, context, chunk_ids, n, regenerate, avoid=(), cache_dir="."):
+    with metrics.span("tools.request"):
+        try:
+            response = "".join(cached_stream(tool_prompt(tool, context, n, avoid), chunk_ids, regenerate,
+                                                 cache_dir=cache_dir))
+        except (OllamaError, requests.RequestException, json.JSONDecodeError) as e:
+            print(f"Error calling DeepSeek: {e}")
+            return []
+    return parse_items(tool, response)
+
+
+def generate(tool, parts, counts, regenerate=False, workers=WORKERS, retries=RETRIES, cache_dir="."):
+    """Yield items for a Smart Tool as soon as each parallel request returns.
+
+    parts is a list of (context, chunk ids), counts the number of items to ask
+    for from each. A request that returns fewer valid items than asked for is
+    re-sent for just the missing ones (bypassing the cache), up to `retries`
+    times. Duplicate items across requests are dropped. cache_dir is the
+    directory of the store the chunks came from (see cached_stream).
+    """
+    seen = set()
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {}
+        for (context, ids), n in zip(parts, counts):
+            if n:
+                pending[pool.submit(_request, tool, context, ids, n, regenerate, (), cache_dir)] = \
+                    (context, ids, n, 0)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                context, ids, n, attempt = pending.pop(future)
+                got = 0
+                for item in future.result()[:n]:
+                    key = _item_key(tool, item)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    got += 1
+                    metrics.incr("tools.items")
+                    yield item
+                if got < n and attempt < retries:
+                    metrics.incr("tools.retries")
+                    avoid = list(seen)[:20]
+                    pending[pool.submit(_request, tool, context, ids, n - got, True, avoid, cache_dir)] = \
+                        (context, ids, n - got, attempt + 1)
+
+
+def split_count(total, n_parts):
+    return [total // n_parts + (1 if i < total % n_parts else 0) for i in range(n_parts)]
+
+
+def context_parts(chunks, total, per_request=ITEMS_PER_REQUEST):
+    """Split retrieved chunks across requests: (parts, item counts).
+
+    Each request gets a round-robin share of the (deduplicated, budgeted)
+    chunks, so parallel requests see different material and prefill less.
+    """
+    n_requests = max(1, -(-total // per_request))
+    context, ids = build_context(chunks)
+    used = [chunk for chunk in chunks if chunk["id"] in ids]
+    if len(used) < n_requests:
+        # Too few chunks to share out: every request sees them all, rotated so
+        # each starts from (and leans on) a different one
+        shifts = [i % len(used) if used else 0 for i in range(n_requests)]
+        parts = [build_context(used[shift:] + used[:shift]) for shift in shifts]
+        return parts, split_count(total, n_requests)
+    groups = [used[i::n_requests] for i in range(n_requests)]
+    parts = [build_context(group) for group in groups]
+    return parts, split_count(total, n_requests)
+
+
+def text_parts(text, part_tokens=KEY_POINT_PART_TOKENS, per_part=KEY_POINTS_PER_PART):
+    """Split pasted text at paragraph breaks into parts of about part_tokens: (parts, item counts)."""
+    parts, current, size = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        tokens = count_tokens(paragraph)
+        if current and size + tokens > part_tokens:
+            parts.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += tokens
+    if current:
+        parts.append("\n\n".join(current))
+    return [(part, ()) for part in parts], [per_part] * len(parts)
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+
+class SourceRegistry:
+    """Persistent list of knowledge sources, so they survive restarts.
+
+    Stored as registry.json: {source id: {"name", "type", "added", "chunks"}}.
+    Re-read whenever another process has changed the file. Changes are made
+    under write_lock (the store's cross-process WriteLock), re-reading the
+    file first, so writers in other processes never overwrite each other.
+    """
+
+    def __init__(self, path="registry.json", write_lock=None):
+        self.path = path
+        self.sources = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._write_lock = write_lock or nullcontext()
+
+    def _refresh(self, force=False):
+        try:
+            stamp = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if force or stamp != self._stamp:
+            with open(self.path, encoding="utf-8") as f:
+                self.sources = json.load(f)
+            self._stamp = stamp
+
+    def _save(self):
+        fd, tmp = tempfile.mkstemp(prefix="registry.", suffix=".tmp", dir=os.path.dirname(self.path) or ".")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.sources, f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._stamp = os.stat(self.path).st_mtime_ns
+
+    def add(self, source_id, name, source_type="text", chunks=0):
+        # The write lock comes first: the store may already hold it when it calls in
+        with self._write_lock, self._lock:
+            self._refresh(force=True)
+            # Re-adding a source (new chunks, a replaced source) keeps its place in the list
+            added = self.sources.get(source_id, {}).get("added") or time.time()
+            self.sources[source_id] = {"name": name, "type": source_type, "added": added, "chunks": chunks}
+            self._save()
+
+    def ensure(self, source_ids):
+        """Register sources found in the store without an entry (e.g. added before the registry existed)."""
+        with self._lock:
+            self._refresh()
+            if all(s in self.sources for s in source_ids):
+                return
+        with self._write_lock, self._lock:
+            self._refresh(force=True)
+            missing = [s for s in source_ids if s not in self.sources]
+            for source_id in missing:
+                self.sources[source_id] = {"name": f"Source {source_id[:8]}", "type": "text",
+                                           "added": 0, "chunks": 0}
+            if missing:
+                self._save()
+
+    def remove(self, source_id):
+        with self._write_lock, self._lock:
+            self._refresh(force=True)
+            if self.sources.pop(source_id, None) is not None:
+                self._save()
+
+    def get(self, source_id):
+        with self._lock:
+            self._refresh()
+            return self.sources.get(source_id)
+
+    def list(self):
+        """All sources as {"id", "name", "type", "added", "chunks"} dicts, oldest first."""
+        with self._lock:
+            self._refresh()
+            return sorted(({"id": i, **s} for i, s in self.sources.items()), key=lambda s: s["added"])
@@ -0,0 +1,25 @@
+"""A stand-in for the embedding model, so store tests need no model download."""
+import zlib
+import numpy as np
+
+
+class StubModel:
+    """Deterministic unit vectors from a text hash, like benchmarks/run.py's."""
+
+    tokenizer = None  # the chunker falls back to approximate token counts
+
+    def __init__(self):
+        self.basis = np.random.default_rng(0).standard_normal((4096, 384)).astype("float32")
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, **kwargs):
+        h = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in texts), dtype="int64", count=len(texts))
+        vectors = self.basis[h % 4096] + 0.5 * self.basis[(h >> 12) % 4096]
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def install():
+    """Make every VectorStore in this process embed with StubModel."""
+    import vector_store
+    vector_store._models[(vector_store.MODEL_NAME, "torch")] = StubModel()
@@ -0,0 +1,55 @@
+import multiprocessing
+import time
+import jobs
+from jobs import JobQueue
+
+
+def _claim(path):
+    JobQueue(path).claim()  # then exit, leaving the job running
+
+
+def test_requeue_jobs_of_dead_local_worker(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    job_id = queue.submit("text", text="hello", name="note")
+    worker = multiprocessing.get_context("spawn").Process(target=_claim, args=(path,))
+    worker.start()
+    worker.join(60)
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.requeue_stale() == 1
+    assert queue.get(job_id)["status"] == "queued"
+
+
+def test_live_local_worker_keeps_its_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit("text", text="hello", name="note")
+    queue.claim()
+    assert queue.requeue_stale() == 0
+    assert queue.requeue_stale(all_workers=True) == 1
+    assert queue.get(job_id)["status"] == "queued"
+
+
+def test_requeue_after_remote_heartbeat_expires(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit("text", text="hello", name="note")
+    queue.claim()
+
+    def beat(age):
+        queue._conn.execute("UPDATE jobs SET worker = 'other-host:123', heartbeat = ? WHERE id = ?",
+                            (time.time() - age, job_id))
+        queue._conn.commit()
+
+    beat(0)
+    assert queue.requeue_stale() == 0
+    beat(jobs.HEARTBEAT_TIMEOUT + 1)
+    assert queue.requeue_stale() == 1
+    assert queue.get(job_id)["status"] == "queued"
+
+
+def test_heartbeat_refreshes_running_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.submit("text", text="hello", name="note")
+    first = queue.claim()["heartbeat"]
+    time.sleep(0.01)
+    queue.heartbeat(job_id)
+    assert queue.get(job_id)["heartbeat"] > first
@@ -0,0 +1,54 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import ollama_chat
+from llm_cache import get_response_cache
+
+
+def _serve(lines):
+    """A stand-in Ollama that streams `lines` (dicts) from /api/generate, then hangs up."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for line in lines:
+                self.wfile.write(json.dumps(line).encode() + b"\n")
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    servers = []
+
+    def start(lines):
+        server = _serve(lines)
+        servers.append(server)
+        monkeypatch.setenv("OLLAMA_HOST", f"127.0.0.1:{server.server_address[1]}")
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_complete_stream_is_cached(ollama, tmp_path):
+    ollama([{"response": "Hello"}, {"response": " there"}, {"done": True}])
+    assert "".join(ollama_chat.cached_stream("hi", [1], cache_dir=str(tmp_path))) == "Hello there"
+    cache = get_response_cache(str(tmp_path))
+    assert cache.get(cache.key(ollama_chat.MODEL, "hi", [1])) == "Hello there"
+
+
+def test_truncated_stream_raises_and_is_not_cached(ollama, tmp_path):
+    ollama([{"response": "Hello"}])  # no "done": Ollama went away mid-answer
+    with pytest.raises(ollama_chat.OllamaError):
+        "".join(ollama_chat.cached_stream("hi", [1], cache_dir=str(tmp_path)))
+    cache = get_response_cache(str(tmp_path))
+    assert cache.get(cache.key(ollama_chat.MODEL, "hi", [1])) is None
@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+from chunk_store import WriteLock
+from source_registry import SourceRegistry
+
+SOURCES_PER_PROCESS = 100
+
+
+def _add_sources(directory, worker):
+    registry = SourceRegistry(os.path.join(directory, "registry.json"),
+                              WriteLock(os.path.join(directory, ".write.lock")))
+    for i in range(SOURCES_PER_PROCESS):
+        registry.add(f"{worker}-{i}", f"Source {i} of worker {worker}")
+    for i in range(0, SOURCES_PER_PROCESS, 10):
+        registry.remove(f"{worker}-{i}")
+
+
+def test_add_and_remove_keep_order(tmp_path):
+    registry = SourceRegistry(str(tmp_path / "registry.json"))
+    registry.add("a", "First", "pdf", 3)
+    registry.add("b", "Second")
+    registry.add("a", "First, replaced", "pdf", 5)
+    registry.remove("b")
+    assert [s["id"] for s in registry.list()] == ["a"]
+    assert registry.get("a")["chunks"] == 5
+    assert SourceRegistry(str(tmp_path / "registry.json")).get("a")["name"] == "First, replaced"
+
+
+def test_concurrent_processes_keep_every_entry(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_add_sources, args=(str(tmp_path), w)) for w in range(3)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(120)
+    assert [p.exitcode for p in workers] == [0, 0, 0]
+    expected = {f"{w}-{i}" for w in range(3) for i in range(SOURCES_PER_PROCESS) if i % 10}
+    registry = SourceRegistry(str(tmp_path / "registry.json"))
+    assert {s["id"] for s in registry.list()} == expected
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
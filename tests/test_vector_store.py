@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+import stub_model
+from vector_store import VectorStore
+
+BATCH = 50
+
+
+def _texts(writer, batch):
+    return [f"writer {writer} batch {batch} chunk {i}" for i in range(BATCH)]
+
+
+def _write(directory, writer, batches=None):
+    """Add batches of texts (forever when batches is None) from another process."""
+    stub_model.install()
+    vs = VectorStore(directory, index_type="flat")
+    batch = 0
+    while batches is None or batch < batches:
+        vs.add_texts(_texts(writer, batch), f"writer-{writer}")
+        batch += 1
+
+
+def _check_rows(vs):
+    """Every row's vector is its own text's embedding, and its source wrote that text."""
+    n = vs.index.ntotal
+    texts = [vs.chunks.get(row)["chunk"] for row in range(n)]
+    expected = stub_model.StubModel().encode(texts)
+    assert np.allclose(vs.index.reconstruct_n(0, n), expected, atol=1e-5)
+    for source, groups in vs.source_rows.items():
+        writer = source.split("-")[1]
+        for row in np.concatenate(groups):
+            assert texts[row].startswith(f"writer {writer} ")
+    return texts
+
+
+@pytest.fixture(autouse=True)
+def stub(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the embedding cache lives in the working directory
+    stub_model.install()
+
+
+def test_concurrent_writers_keep_every_row(tmp_path):
+    directory = str(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=_write, args=(directory, w, 20)) for w in range(3)]
+    for p in writers:
+        p.start()
+    for p in writers:
+        p.join(300)
+    assert [p.exitcode for p in writers] == [0, 0, 0]
+    vs = VectorStore(directory, index_type="flat")
+    assert vs.index.ntotal == 3 * 20 * BATCH
+    _check_rows(vs)
+    assert {s: sum(len(g) for g in groups) for s, groups in vs.source_rows.items()} == \
+        {f"writer-{w}": 20 * BATCH for w in range(3)}
+
+
+def test_replay_sees_rows_appended_after_refresh(tmp_path):
+    reader = VectorStore(str(tmp_path), index_type="flat")
+    writer = VectorStore(str(tmp_path), index_type="flat")
+    writer.add_texts(_texts(0, 0), "writer-0")
+    # The reader's chunk map predates the rows that the new WAL record points at
+    with reader._lock:
+        reader._replay_wal()
+        reader.bm25.sync(reader.chunks, reader.index.ntotal)
+    assert reader.index.ntotal == BATCH
+    assert len(reader._recent_hashes) == BATCH
+    _check_rows(reader)
+
+
+def test_reopen_after_kill_during_appends(tmp_path):
+    directory = str(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    for delay in (0.5, 1.0, 1.5):
+        writer = context.Process(target=_write, args=(directory, int(delay * 10)))
+        writer.start()
+        time.sleep(delay + 2)  # spawn start-up, then some appends
+        writer.kill()
+        writer.join()
+        vs = VectorStore(directory, index_type="flat")
+        texts = _check_rows(vs)
+        assert len(set(texts)) == len(texts)
+    # A torn record at the end of the log is ignored, then overwritten by the next append
+    rows = vs.index.ntotal
+    with open(os.path.join(directory, "vector.wal"), "ab") as f:
+        f.write(b"\x10\x00\x00\x00torn")
+    vs = VectorStore(directory, index_type="flat")
+    assert vs.index.ntotal == rows
+    vs.add_texts(_texts(99, 0), "writer-99")
+    reopened = VectorStore(directory, index_type="flat")
+    assert reopened.index.ntotal == rows + BATCH
+    _check_rows(reopened)
@@ -1,54 +1,870 @@
+import atexit
 import faiss
+import metrics
+import numpy as np
 from sentence_transformers import SentenceTransformer
+import torch
+from bm25 import BM25Index, reciprocal_rank_fusion
+from chunk_store import DELETION, LINK, ChunkStore, VectorFile, WriteLock, chunk_hash
+from embedding_cache import EmbeddingCache
+from index_backends import (KINDS, build_index, can_build, choose_kind, evaluate_recall, index_kind,
+                            index_quantization, is_lossy, reconstruct_rows, search_params, train_index)
 import os
 import pickle
 import re
+import shutil
+import struct
+import threading
+import time
+import zlib
+from llm_cache import get_response_cache
 from ollama_chat import call_deepseek
+from source_registry import SourceRegistry
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+_models = {}
+_models_lock = threading.Lock()
+_encode_pools = {}
+
+HYBRID_DEPTH = 4  # each ranker contributes k * HYBRID_DEPTH candidates to the fusion
+REBUILD_DEAD_FRACTION = 0.25  # rebuild in the background once this share of rows is dead
+REBUILD_DIR = "rebuild.tmp"
+STALE_REBUILD_SECONDS = 24 * 3600
+MULTI_PROCESS_MIN = 512  # smaller batches aren't worth shipping to worker processes
+EXACT_FILTER_ROWS = 20_000  # IVF searches restricted to fewer rows than this scan those rows exactly
+RESCORE_FACTOR = 4  # a lossy index returns this many times the candidates, re-ranked with exact vectors
+ENCODERS = ("torch", "onnx")
+
+# Each WAL record is <payload length, crc32> followed by a pickled
+# (first row, embeddings, source id) tuple; the chunk texts themselves are
+# already in the ChunkStore by the time the record is written
+WAL_HEADER = struct.Struct("<II")
+COMPACT_WAL_BYTES = 64 * 1024 * 1024
+# Rows in the WAL are re-tokenized for BM25 on every load, so the log is also
+# folded once it holds this many rows (or this share of the base rows, so big
+# stores aren't rewritten too often), or has had rows waiting this long
+COMPACT_WAL_ROWS = 5_000
+COMPACT_WAL_FRACTION = 0.1
+COMPACT_WAL_SECONDS = 10 * 60
+
+
+def get_model(name=MODEL_NAME, encoder="torch"):
+    """Load an embedding model once per process and share it between stores.
+
+    encoder "onnx" runs a copy exported beforehand with `python onnx_encoder.py`
+    (int8-quantized) through onnxruntime; it falls back to PyTorch if there is
+    no export or it can't be loaded.
+    """
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown encoder: {encoder} (choose from {', '.join(ENCODERS)})")
+    with _models_lock:
+        if (name, encoder) not in _models:
+            model = None
+            if encoder == "onnx":
+                try:
+                    from onnx_encoder import load_onnx_model
+                    model = load_onnx_model(name)
+                except Exception as e:
+                    print(f"ONNX encoder unavailable, using PyTorch: {e}")
+            if model is None:
+                if (name, "torch") not in _models:
+                    _models[(name, "torch")] = SentenceTransformer(name)
+                model = _models[(name, "torch")]
+            _models[(name, encoder)] = model
+        return _models[(name, encoder)]
+
+
+def get_encode_pool(name, workers, threads=None):
+    """Start (once) a sentence-transformers multi-process pool of CPU workers."""
+    with _models_lock:
+        if (name, workers) not in _encode_pools:
+            # Workers inherit the environment; cap their torch threads so
+            # `workers` processes don't each try to use every core
+            threads = threads or max(1, (os.cpu_count() or 1) // workers)
+            previous = os.environ.get("OMP_NUM_THREADS")
+            os.environ["OMP_NUM_THREADS"] = str(threads)
+            try:
+                model = _models.get((name, "torch")) or SentenceTransformer(name)
+                pool = model.start_multi_process_pool(["cpu"] * workers)
+            finally:
+                if previous is None:
+                    del os.environ["OMP_NUM_THREADS"]
+                else:
+                    os.environ["OMP_NUM_THREADS"] = previous
+            _encode_pools[(name, workers)] = pool
+            atexit.register(SentenceTransformer.stop_multi_process_pool, pool)
+        return _encode_pools[(name, workers)]
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _fsync_path(path):
+    """Flush a file written by another library (e.g. faiss.write_index) to disk."""
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path):
+    """Make renames in a directory durable (a no-op where directories can't be opened, e.g. Windows)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _read_wal(path, offset):
+    """Yield (end offset, record) for every complete record after offset."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        while True:
+            header = f.read(WAL_HEADER.size)
+            if len(header) < WAL_HEADER.size:
+                return
+            size, crc = WAL_HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size or zlib.crc32(payload) != crc:
+                return  # torn write; nothing after it was acknowledged
+            offset += WAL_HEADER.size + size
+            yield offset, pickle.loads(payload)
+
 
 class VectorStore:
-    def __init__(self):
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.index_file = "vector.index"
-        self.data_file = "docs.pkl"
-        self.texts = []  # Each item: {'chunk': ..., 'source': ...}
+    def __init__(self, directory=".", model_name=MODEL_NAME, index_type="auto", nprobe=16, ef_search=64,
+                 encode_batch_size=32, encode_workers=1, encode_threads=None, quantization=None, encoder="torch"):
+        self.directory = directory
+        self.model_name = model_name
+        self.encoder = encoder  # "torch" or "onnx", see get_model()
+        self.encode_batch_size = encode_batch_size
+        # encode_workers > 1 shards large add_texts batches across CPU processes;
+        # encode_threads caps torch threads per worker (or in-process when 1 worker)
+        self.encode_workers = encode_workers
+        self.encode_threads = encode_threads
+        # "auto" moves flat -> hnsw -> ivf_flat -> ivf_pq as the corpus grows;
+        # any name from index_backends.KINDS pins the store to that kind
+        self.index_type = index_type
+        self.nprobe = nprobe  # IVF lists probed per query
+        self.ef_search = ef_search  # HNSW candidate list size per query
+        self.recall = None  # recall@10 vs. exact search measured at the last migration
+        # "fp16" or "sq8" keeps the index at 2 or 1 bytes per dimension; full
+        # vectors then live (as fp16) in vectors.f16 on disk, read back only to
+        # rescore the top candidates
+        self.quantization = quantization
+        os.makedirs(directory, exist_ok=True)
+        self.index_file = os.path.join(directory, "vector.index")
+        # pickled chunk list, imported into self.chunks once
+        self.legacy_data_file = os.path.join(directory, "docs.pkl")
+        # appended on every add, folded in by compact()
+        self.wal_file = os.path.join(directory, "vector.wal")
+        # snapshot written by compact(), newer rows re-indexed on load
+        self.bm25_file = os.path.join(directory, "bm25.pkl")
+        self.vectors_file = os.path.join(directory, "vectors.f16")
+        self.bm25 = BM25Index()
+        # Held (after self._lock) by every write, so several processes can add to one store
+        self._write_lock = WriteLock(os.path.join(directory, ".write.lock"))
+        self.registry = SourceRegistry(os.path.join(directory, "registry.json"), self._write_lock)
+        with self._write_lock:
+            self._recover_rebuild()
+        self.chunks = ChunkStore(directory)
+        self.vectors = VectorFile(self.vectors_file) if quantization else None
+        # ONNX embeddings differ slightly from PyTorch ones, so they're cached apart
+        self.embedding_cache = EmbeddingCache(model_name if encoder == "torch" else f"{model_name}+{encoder}")
+        # Use normalized inner product index for better semantic search
+        self.index = faiss.IndexFlatIP(384)
+        self.source_rows = {}  # live source id -> arrays of index rows, used to filter at search time
+        self.dead_rows = 0  # rows no live source refers to any more; reclaimed by rebuild()
+        self._dead = np.empty(0, dtype="int64")  # those rows, sorted
+        self._dead_selector = None  # excludes self._dead; new rows are live, so adds keep it valid
+        self._selector_cache = (None, None, None)
+        # content hash -> row, as a sorted array for the base rows plus a dict for newer ones
+        self._hash_index = (np.empty(0, dtype="<u8"), np.empty(0, dtype="int64"))
+        self._recent_hashes = {}
+        self._changes_seen = (0, 0)  # links / deletions already reflected in source_rows
+        self._generation = 0  # bumped when rebuild() renumbers rows
+        self._lock = threading.RLock()
+        self._base_stamp = None
+        self._wal_offset = 0
+        self._base_rows = 0  # rows in vector.index; the rest came from the WAL
+        self._compacted_at = time.monotonic()
+        self._compacting = False
+        self._migrating = False
+        self._rebuilding = False
+        self._reload_if_changed()
+        self._maybe_migrate()
 
+    @property
+    def busy(self):
+        """Whether a background migration, compaction or rebuild is running."""
+        return self._migrating or self._compacting or self._rebuilding
+
+    @property
+    def model(self):
+        return get_model(self.model_name, self.encoder)
+
+    def warm_up(self):
+        """Load the embedding model in the background so the first query doesn't pay for it."""
+        threading.Thread(target=get_model, args=(self.model_name, self.encoder), daemon=True).start()
+
+    def _encode(self, texts):
+        metrics.incr("embed.texts", len(texts))
+        with metrics.span("embed.encode"):
+            if self.encode_workers > 1 and len(texts) >= MULTI_PROCESS_MIN and self.encoder == "torch":
+                pool = get_encode_pool(self.model_name, self.encode_workers, self.encode_threads)
+                return self.model.encode_multi_process(texts, pool, batch_size=self.encode_batch_size,
+                                                       normalize_embeddings=True)
+            if self.encode_threads:
+                torch.set_num_threads(self.encode_threads)
+            return self.model.encode(texts, batch_size=self.encode_batch_size, normalize_embeddings=True)
+
+    def _reload_if_changed(self):
+        # Another process (or another store instance) may have compacted or appended
+        base = _stat(self.index_file)
+        wal = _stat(self.wal_file)
+        links = _stat(self.chunks.links_file)
+        deleted = _stat(self.chunks.deleted_file)
+        seen_links, seen_deleted = self._changes_seen
+        if (base == self._base_stamp and (wal[1] if wal else 0) <= self._wal_offset
+                and (links[1] if links else 0) <= seen_links * LINK.itemsize
+                and (deleted[1] if deleted else 0) <= seen_deleted * DELETION.itemsize):
+            return
+        with self._lock:
+            self.chunks.refresh()
+            if self.vectors is not None:
+                self.vectors.refresh()
+            base = _stat(self.index_file)
+            if base != self._base_stamp:
+                self._load_base()
+                self._base_stamp = base
+                self._wal_offset = 0
+            self._replay_wal()
+            if (len(self.chunks.links), len(self.chunks.deleted)) != self._changes_seen:
+                self._group_sources()
+            if self.bm25.n_rows > self.index.ntotal:
+                self.bm25 = BM25Index()  # snapshot from a newer index than the one on disk
+            self.bm25.sync(self.chunks, self.index.ntotal)
+
+    def _load_base(self):
+        index = faiss.IndexFlatIP(384)
         if os.path.exists(self.index_file):
-            self.index = faiss.read_index(self.index_file)
-            with open(self.data_file, "rb") as f:
-                self.texts = pickle.load(f)
-        else:
-            # Use normalized inner product index for better semantic search
-            self.index = faiss.IndexFlatIP(384)
+            index = faiss.read_index(self.index_file)
+            if os.path.exists(self.legacy_data_file) and len(self.chunks) == 0:
+                self._import_legacy(index.ntotal)
+        self.chunks.backfill_hashes(index.ntotal)
+        self.index = index
+        self._base_rows = index.ntotal
+        if self.vectors is not None:
+            self.vectors = VectorFile(self.vectors_file)  # may have been replaced by rebuild()
+            if len(self.vectors) < index.ntotal and not is_lossy(index):
+                # Store created before quantization was turned on: copy the vectors out once
+                self.vectors.write(len(self.vectors), reconstruct_rows(index, len(self.vectors), index.ntotal))
+        hashes = np.asarray(self.chunks.hashes[:index.ntotal])
+        order = np.argsort(hashes, kind="stable")
+        self._hash_index = (hashes[order], order)
+        self._recent_hashes = {}
+        self.bm25 = BM25Index.load(self.bm25_file)
+        self._group_sources()
+        self.registry.ensure(list(self.source_rows))
 
-    def add_texts(self, docs, source_id):
-        chunks = [{'chunk': doc, 'source': source_id} for doc in docs]
-        embeddings = self.model.encode([doc['chunk'] for doc in chunks], normalize_embeddings=True)
+    def _group_sources(self):
+        groups = self.chunks.source_rows(self.index.ntotal)
+        self.source_rows = {source: [rows] for source, rows in groups.items()}
+        live = np.unique(np.concatenate(list(groups.values()))) if groups else np.empty(0, dtype="int64")
+        self._dead = np.setdiff1d(np.arange(self.index.ntotal, dtype="int64"), live, assume_unique=True)
+        self.dead_rows = len(self._dead)
+        self._dead_selector = None
+        self._changes_seen = (len(self.chunks.links), len(self.chunks.deleted))
+        self._selector_cache = (None, None, None)
+
+    def _find_rows(self, hashes):
+        """Row already holding each content hash, or -1."""
+        sorted_hashes, order = self._hash_index
+        rows = np.full(len(hashes), -1, dtype="int64")
+        if len(sorted_hashes):
+            pos = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+            hit = sorted_hashes[pos] == hashes
+            rows[hit] = order[pos[hit]]
+        for i in np.flatnonzero(rows < 0):
+            rows[i] = self._recent_hashes.get(int(hashes[i]), -1)
+        return rows
+
+    def _import_legacy(self, n):
+        """Move a docs.pkl chunk list into the ChunkStore, one run of rows per source."""
+        with open(self.legacy_data_file, "rb") as f:
+            texts = pickle.load(f)[:n]
+        start = 0
+        while start < len(texts):
+            source = texts[start]['source']
+            end = start
+            while end < len(texts) and texts[end]['source'] == source:
+                end += 1
+            docs = [t['chunk'] for t in texts[start:end]]
+            self.chunks.append(docs, source, start, [chunk_hash(d) for d in docs])
+            start = end
+        os.replace(self.legacy_data_file, self.legacy_data_file + ".migrated")
+
+    def _extend(self, start, embeddings, source):
+        end = start + len(embeddings)
+        self.source_rows.setdefault(source, []).append(np.arange(start, end))
+        self._forget_selector(source)
+        self._recent_hashes.update(zip(self.chunks.hashes[start:end].tolist(), range(start, end)))
+        if self.vectors is not None and start <= len(self.vectors) < end:
+            self.vectors.write(len(self.vectors), embeddings[len(self.vectors) - start:])
         self.index.add(embeddings)
-        self.texts.extend(chunks)
-        faiss.write_index(self.index, self.index_file)
-        with open(self.data_file, "wb") as f:
-            pickle.dump(self.texts, f)
-
-    def query(self, query, k=5, allowed_sources=None):
-        query_embedding = self.model.encode([query], normalize_embeddings=True)
-
-        distances, indices = self.index.search(query_embedding, k=10)  # Fetch more initially
-
-        results = []
-        for idx in indices[0]:
-            if idx == -1:
-                continue
-            if 0 <= idx < len(self.texts):
-                if allowed_sources is None or self.texts[idx]['source'] in allowed_sources:
-                    results.append((idx, distances[0][list(indices[0]).index(idx)]))
-
-        # For inner product, higher score = better match
-        results.sort(key=lambda x: -x[1])  # Sort descending
-
-        final_texts = []
-        for i, _ in results[:k]:
-            final_texts.append(self.texts[i])
-        return final_texts
+
+    def _replay_wal(self):
+        for end, (start, embeddings, source) in _read_wal(self.wal_file, self._wal_offset):
+            if isinstance(source, list):
+                # Record written before chunk texts moved out of the WAL
+                chunks, source = source, source[0]['source'] if source else None
+                if chunks and len(self.chunks) < start + len(chunks):
+                    docs = [c['chunk'] for c in chunks]
+                    self.chunks.append(docs, source, start, [chunk_hash(d) for d in docs])
+            if len(self.chunks) < start + len(embeddings):
+                # Another writer appended the rows (always before the record) after our last refresh
+                self.chunks.refresh()
+            skip = self.index.ntotal - start  # rows already folded into vector.index
+            if skip < 0:
+                break
+            if skip < len(embeddings):
+                self._extend(start + skip, embeddings[skip:], source)
+            self._wal_offset = end
+
+    def _append_wal(self, start, embeddings, source):
+        payload = pickle.dumps((start, embeddings, source), protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.wal_file, "ab") as f:
+            f.truncate(self._wal_offset)  # drop a torn record left behind by a crash
+            f.write(WAL_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+            self._wal_offset = f.tell()
+
+    def _target_kind(self):
+        if self.index_type != "auto":
+            return self.index_type
+        current = index_kind(self.index)
+        wanted = choose_kind(self.index.ntotal)
+        # Never step back down; a shrinking corpus keeps its trained index
+        return max(current, wanted, key=KINDS.index)
+
+    def _target_quantization(self, kind, ntotal):
+        if kind == "ivf_pq":
+            return "pq"
+        # sq8 waits for enough rows to learn its ranges; until then vectors stay float32
+        return self.quantization if can_build(kind, ntotal, self.quantization) else None
+
+    def _maybe_migrate(self):
+        with self._lock:
+            kind = self._target_kind()
+            quantization = self._target_quantization(kind, self.index.ntotal)
+            if (self._migrating or not can_build(kind, self.index.ntotal)
+                    or (kind, quantization) == (index_kind(self.index), index_quantization(self.index))):
+                return
+            self._migrating = True
+        threading.Thread(target=self.migrate, args=(kind, quantization), daemon=True).start()
+
+    def _exact_rows(self, index, start, stop):
+        """Vectors for rows start..stop, from vectors.f16 when the index itself is lossy."""
+        if self.vectors is not None and len(self.vectors) >= stop:
+            return self.vectors.read(start, stop)
+        return reconstruct_rows(index, start, stop)
+
+    def migrate(self, kind, quantization=None):
+        """Rebuild the index as `kind`, training it off the lock, then swap it in."""
+        if quantization == "pq":
+            quantization = None  # IVF-PQ is compressed by construction
+        try:
+            with self._lock:
+                self._migrating = True
+                old = self.index
+                n = old.ntotal
+                vectors = self._exact_rows(old, 0, n)
+
+            with metrics.span("index.migrate"):
+                index = build_index(kind, n, quantization=quantization)
+                train_index(index, vectors)
+                index.add(vectors)
+            params = search_params(index, nprobe=self.nprobe, ef_search=self.ef_search)
+            recall = evaluate_recall(index, vectors, params=params)
+            del vectors
+
+            with self._lock:
+                if self.index is not old:
+                    return  # reloaded from disk meanwhile; the next add retries
+                # Catch up on rows added while we were training
+                index.add(self._exact_rows(old, n, old.ntotal))
+                self.index = index
+                self.recall = recall
+        finally:
+            self._migrating = False
+        # Persist the new index type so the next startup doesn't rebuild it
+        self.compact()
+
+    def _maybe_compact(self):
+        with self._lock:
+            wal_rows = self.index.ntotal - self._base_rows
+            due = (self._wal_offset >= COMPACT_WAL_BYTES
+                   or wal_rows >= max(COMPACT_WAL_ROWS, COMPACT_WAL_FRACTION * self._base_rows)
+                   or (wal_rows and time.monotonic() - self._compacted_at >= COMPACT_WAL_SECONDS))
+            if self._compacting or not due:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def close(self):
+        """Fold the WAL into vector.index and bm25.pkl, so the next load has nothing to replay."""
+        with self._lock:
+            if self._compacting or self.index.ntotal == self._base_rows:
+                return
+            self._compacting = True
+        self.compact()
+
+    def compact(self):
+        """Fold the WAL into vector.index and start a fresh log."""
+        try:
+            with self._lock:
+                self._compacting = True
+                index = faiss.clone_index(self.index)
+                offset = self._wal_offset
+                generation = self._generation
+
+            tmp_index = self.index_file + ".tmp"
+            faiss.write_index(index, tmp_index)
+            _fsync_path(tmp_index)  # the WAL is truncated below, so the index must be on disk first
+
+            with self._lock, self._write_lock:
+                if generation != self._generation or _stat(self.index_file) != self._base_stamp:
+                    os.remove(tmp_index)  # rebuild() or another process already wrote a newer store
+                    return
+                self._reload_if_changed()  # records other processes appended stay in the new log
+                os.replace(tmp_index, self.index_file)
+                self.bm25.save(self.bm25_file)
+                # Keep only the records appended while the snapshot was being written
+                tail = b""
+                if os.path.exists(self.wal_file):
+                    with open(self.wal_file, "rb") as f:
+                        f.seek(offset)
+                        tail = f.read(self._wal_offset - offset)
+                tmp_wal = self.wal_file + ".tmp"
+                with open(tmp_wal, "wb") as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_wal, self.wal_file)
+                _fsync_dir(self.directory)
+                self._wal_offset = len(tail)
+                self._base_stamp = _stat(self.index_file)
+                self._base_rows = index.ntotal
+                self._compacted_at = time.monotonic()
+        finally:
+            self._compacting = False
+
+    def add_texts(self, docs, source_id):
+        docs = list(docs)
+        if not docs:
+            return
+        hashes = np.array([chunk_hash(d) for d in docs], dtype="<u8")
+        with self._lock:
+            self._reload_if_changed()
+            known = self._find_rows(hashes)
+        # Only the first copy of each chunk the store hasn't seen needs a vector
+        _, first = np.unique(hashes, return_index=True)
+        new = np.sort(first[known[first] < 0])
+        # Encode outside the lock so concurrent readers aren't blocked by the model;
+        # chunks seen before (in any store using this model) come from the cache
+        embeddings = self.embedding_cache.encode(self._encode, [docs[i] for i in new])
+        with self._lock, self._write_lock:
+            self._reload_if_changed()
+            # Another writer may have stored some of these chunks while we were encoding
+            keep = self._find_rows(hashes[new]) < 0
+            new, embeddings = new[keep], embeddings[keep]
+            start = self.index.ntotal
+            if len(new):
+                # Texts first: a WAL record must never point at rows that don't exist
+                self.chunks.append([docs[i] for i in new], source_id, start, hashes[new])
+                self._append_wal(start, embeddings, source_id)
+                self._extend(start, embeddings, source_id)
+                self.bm25.sync(self.chunks, self.index.ntotal)
+                metrics.incr("index.rows_added", len(new))
+            # Identical chunks are stored once; the source just gets linked to them
+            shared = np.unique(self._find_rows(hashes))
+            shared = shared[(shared >= 0) & (shared < start)]
+            if len(shared):
+                self.chunks.link(shared, source_id)
+                metrics.incr("index.rows_linked", len(shared))
+                if self.dead_rows:
+                    self._group_sources()  # links can bring tombstoned rows back to life
+                else:
+                    self._changes_seen = (len(self.chunks.links), len(self.chunks.deleted))
+                    self.source_rows.setdefault(source_id, []).append(shared)
+                    self._forget_selector(source_id)
+        self._maybe_migrate()
+        self._maybe_compact()
+
+    def delete_source(self, source_id):
+        """Remove a source. Its rows stop matching right away; rebuild() reclaims their space.
+
+        Rows shared with other sources (identical chunks) stay live for those sources.
+        Returns the number of rows the source held.
+        """
+        with self._lock, self._write_lock:
+            self._reload_if_changed()
+            rows = np.concatenate(self.source_rows.get(source_id, [np.empty(0, dtype="int64")]))
+            self.chunks.delete_source(source_id, self.index.ntotal)
+            self._group_sources()
+        self.registry.remove(source_id)
+        # Answers built from this source's chunks are stale now
+        get_response_cache(self.directory).invalidate_chunks(rows)
+        self._maybe_rebuild()
+        return len(rows)
+
+    def replace_source(self, source_id, docs):
+        """Swap a source's chunks for docs, keeping its id and registry entry."""
+        docs = list(docs)
+        entry = self.registry.get(source_id)
+        self.delete_source(source_id)
+        self.add_texts(docs, source_id)
+        if entry:
+            self.registry.add(source_id, entry["name"], entry["type"], len(docs))
+
+    def _maybe_rebuild(self):
+        with self._lock:
+            if self._rebuilding or self.dead_rows <= REBUILD_DEAD_FRACTION * self.index.ntotal:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def rebuild(self):
+        """Rewrite the store without dead rows, retraining the index for the live corpus size.
+
+        Like migrate(), the new chunk files and index are built off the lock
+        (in a rebuild.<pid>.partial/ directory). The lock is only taken to
+        snapshot the live rows, and at the end to carry over rows added in
+        the meantime and move the new files into place through rebuild.tmp/;
+        an interrupted move is finished on the next startup.
+        Returns the number of rows reclaimed.
+        """
+        try:
+            with self._lock, self._write_lock:
+                self._rebuilding = True
+                self._reload_if_changed()
+                dead = self.dead_rows
+                if not dead:
+                    return 0
+                plan = self._plan_rebuild()
+
+            with metrics.span("index.rebuild"):
+                self._write_rebuild(plan)
+
+            with self._lock, self._write_lock:
+                self._reload_if_changed()
+                if not self._catch_up_rebuild(plan):
+                    # Sources were deleted (or another process rebuilt) meanwhile: redo it under the lock
+                    shutil.rmtree(plan["dir"], ignore_errors=True)
+                    dead = self.dead_rows
+                    plan = self._plan_rebuild()
+                    self._write_rebuild(plan)
+                faiss.write_index(plan["index"], os.path.join(plan["dir"], "vector.index"))
+                _fsync_path(os.path.join(plan["dir"], "vector.index"))
+                plan["bm25"].save(os.path.join(plan["dir"], "bm25.pkl"))
+                _fsync_dir(plan["dir"])
+                tmp_dir = os.path.join(self.directory, REBUILD_DIR)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.replace(plan["dir"], tmp_dir)
+                # Only written once everything it vouches for is on disk
+                with open(os.path.join(tmp_dir, "COMPLETE"), "w") as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+                _fsync_dir(tmp_dir)
+                _fsync_dir(self.directory)
+                self._finish_rebuild()
+                self._generation += 1
+                self.chunks = ChunkStore(self.directory)
+                self._base_stamp = None
+                self._wal_offset = 0
+                self._reload_if_changed()
+            # Chunk ids were renumbered, so cached answers can't be invalidated by id any more
+            get_response_cache(self.directory).clear()
+            return dead
+        finally:
+            self._rebuilding = False
+
+    def _plan_rebuild(self):
+        """Snapshot (under the lock) which rows survive a rebuild and where they go."""
+        # Every live (row, source) membership; each live row is owned by one of its
+        # sources in the new store and linked to the rest
+        names = list(self.source_rows)
+        member_rows = [np.concatenate(self.source_rows[s]) for s in names]
+        pair_rows = np.concatenate(member_rows) if names else np.empty(0, dtype="int64")
+        pair_sources = np.concatenate([np.full(len(r), i) for i, r in enumerate(member_rows)]) if names else pair_rows
+        order = np.lexsort((pair_sources, pair_rows))
+        pair_rows, pair_sources = pair_rows[order], pair_sources[order]
+        new_row = np.r_[True, pair_rows[1:] != pair_rows[:-1]] if len(pair_rows) else np.empty(0, dtype=bool)
+        repeat = np.r_[False, (pair_rows[1:] == pair_rows[:-1]) & (pair_sources[1:] == pair_sources[:-1])] \
+            if len(pair_rows) else new_row
+        live = pair_rows[new_row]
+        remap = np.full(self.index.ntotal, -1, dtype="int64")
+        remap[live] = np.arange(len(live))
+
+        vectors = None  # read off the lock from vectors.f16, or re-encoded
+        if not len(live):
+            vectors = np.empty((0, 384), dtype="float32")
+        elif not (self.vectors is not None and len(self.vectors) >= self.index.ntotal) and not is_lossy(self.index):
+            vectors = self.index.reconstruct_batch(live)  # the index can't be read off the lock
+        return {"dir": os.path.join(self.directory, f"rebuild.{os.getpid()}.partial"), "names": names,
+                "live": live, "owners": pair_sources[new_row], "remap": remap, "rows": self.index.ntotal,
+                "link_rows": pair_rows[~new_row & ~repeat], "link_sources": pair_sources[~new_row & ~repeat],
+                "vectors": vectors, "links": len(self.chunks.links), "deleted": len(self.chunks.deleted),
+                "rows_file": os.stat(self.chunks.rows_file).st_ino if os.path.exists(self.chunks.rows_file) else None}
+
+    def _write_rebuild(self, plan):
+        tmp_dir = plan["dir"]
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        names, live, owners, remap = plan["names"], plan["live"], plan["owners"], plan["remap"]
+
+        chunks = ChunkStore(tmp_dir)
+        run_starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]]) if len(live) else []
+        for start, end in zip(run_starts, list(run_starts[1:]) + [len(live)]):
+            rows = live[start:end]
+            texts = [self.chunks.get(row)['chunk'] for row in rows]
+            chunks.append(texts, names[owners[start]], start, self.chunks.hashes[rows])
+        for i in np.unique(plan["link_sources"]):
+            chunks.link(remap[plan["link_rows"][plan["link_sources"] == i]], names[i])
+
+        vectors = plan.pop("vectors")
+        if vectors is None and self.vectors is not None and len(self.vectors) >= plan["rows"]:
+            vectors = self.vectors.get(live)
+        elif vectors is None:
+            # PQ / sq8 codes are lossy; re-encode instead (mostly embedding cache hits)
+            vectors = self.embedding_cache.encode(self._encode, [chunks.get(i)['chunk'] for i in range(len(live))])
+        target = self.index_type if self.index_type != "auto" else choose_kind(len(live))
+        if not can_build(target, len(live)):
+            target = "flat"
+        quantization = self._target_quantization(target, len(live))
+        index = build_index(target, len(live), quantization=None if quantization == "pq" else quantization)
+        train_index(index, vectors)
+        index.add(vectors)
+        if self.vectors is not None:
+            VectorFile(os.path.join(tmp_dir, "vectors.f16")).write(0, vectors)
+        del vectors
+
+        bm25 = BM25Index()
+        bm25.sync(chunks, len(live))
+        for name in ChunkStore.FILES + ("vector.wal",):
+            open(os.path.join(tmp_dir, name), "ab").close()
+        plan.update(chunks=chunks, index=index, bm25=bm25)
+
+    def _catch_up_rebuild(self, plan):
+        """Carry rows and links added since _plan_rebuild() into the new store (under the lock).
+
+        Returns False when that isn't possible: a source was deleted, another
+        process rebuilt the store, or a new link points at a dropped row.
+        """
+        rows_file = os.stat(self.chunks.rows_file).st_ino if os.path.exists(self.chunks.rows_file) else None
+        if len(self.chunks.deleted) != plan["deleted"] or rows_file != plan["rows_file"]:
+            return False
+        n0, n = plan["rows"], self.index.ntotal
+        remap = np.concatenate([plan["remap"], np.arange(n - n0) + len(plan["live"])])
+        links = np.asarray(self.chunks.links[plan["links"]:])
+        links = links[links["row"] < n]
+        if (remap[links["row"].astype("int64")] < 0).any():
+            return False
+        if n > n0:
+            chunks = plan["chunks"]
+            sources = np.asarray(self.chunks.rows["source"][n0:n])
+            run_starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+            for start, end in zip(run_starts, list(run_starts[1:]) + [n - n0]):
+                rows = np.arange(n0 + start, n0 + end)
+                texts = [self.chunks.get(row)['chunk'] for row in rows]
+                chunks.append(texts, self.chunks.sources[sources[start]], remap[rows[0]], self.chunks.hashes[rows])
+            vectors = self._exact_rows(self.index, n0, n)
+            plan["index"].add(vectors)
+            if self.vectors is not None:
+                VectorFile(os.path.join(plan["dir"], "vectors.f16")).write(len(plan["live"]), vectors)
+            plan["bm25"].sync(chunks, len(chunks))
+        for source in np.unique(links["source"]):
+            plan["chunks"].link(remap[links["row"][links["source"] == source].astype("int64")],
+                                self.chunks.sources[source])
+        metrics.incr("index.rebuild_caught_up", n - n0)
+        return True
+
+    def _finish_rebuild(self):
+        tmp_dir = os.path.join(self.directory, REBUILD_DIR)
+        # vector.index goes last: other processes reload when it changes
+        for name in ChunkStore.FILES + ("bm25.pkl", "vector.wal", "vectors.f16", "vector.index"):
+            src, dst = os.path.join(tmp_dir, name), os.path.join(self.directory, name)
+            if os.path.exists(src):
+                os.replace(src, dst)
+            elif name == "vectors.f16" and os.path.exists(dst):
+                os.remove(dst)  # written without quantization; its rows no longer line up
+        _fsync_dir(self.directory)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _recover_rebuild(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # Left by a rebuild that died before its final step
+            if name.startswith("rebuild.") and name.endswith(".partial") and \
+                    time.time() - os.path.getmtime(path) > STALE_REBUILD_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        tmp_dir = os.path.join(self.directory, REBUILD_DIR)
+        if os.path.isdir(tmp_dir):
+            if os.path.exists(os.path.join(tmp_dir, "COMPLETE")):
+                self._finish_rebuild()
+            else:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _selector(self, allowed_sources):
+        """Faiss selector and sorted row array restricting results to allowed_sources.
+
+        When every live source is allowed the rows come back as None: only
+        dead rows (if any) are excluded, without listing every live row.
+        """
+        allowed = frozenset(allowed_sources)
+        if allowed >= self.source_rows.keys():
+            if not self.dead_rows:
+                return None, None  # every row is allowed, skip filtering
+            if self._dead_selector is None:
+                dead = faiss.IDSelectorBatch(self._dead)
+                self._dead_selector = (faiss.IDSelectorNot(dead), dead)  # the Not doesn't own its argument
+            return self._dead_selector[0], None
+        key, selector, rows = self._selector_cache
+        if key != allowed:
+            groups = [r for s in allowed if s in self.source_rows for r in self.source_rows[s]]
+            rows = np.unique(np.concatenate(groups).astype("int64")) if groups else np.empty(0, dtype="int64")
+            selector = faiss.IDSelectorBatch(rows)
+            self._selector_cache = (allowed, selector, rows)
+        return selector, rows
+
+    def _forget_selector(self, source):
+        # Rows added to a source only invalidate the cached selector if it allows that source
+        if self._selector_cache[0] is not None and source in self._selector_cache[0]:
+            self._selector_cache = (None, None, None)
+
+    def _search(self, query_embeddings, depth, selector, allowed_rows):
+        """Row ids of each query's top depth matches among allowed_rows (all live rows when None)."""
+        params = search_params(self.index, selector, self.nprobe, self.ef_search)
+        if selector is None or not index_kind(self.index).startswith("ivf"):
+            return self.index.search(query_embeddings, depth, params=params)[1]
+        n_allowed = self.index.ntotal - self.dead_rows if allowed_rows is None else len(allowed_rows)
+        if not n_allowed:
+            return np.full((len(query_embeddings), depth), -1, dtype="int64")
+        # IVF only applies the selector inside the probed lists, so a narrow
+        # filter finds few allowed rows there: scan small row sets exactly...
+        if allowed_rows is not None and len(allowed_rows) <= EXACT_FILTER_ROWS:
+            metrics.incr("query.exact_filtered")
+            if self.vectors is not None and len(self.vectors) >= self.index.ntotal:
+                vectors = self.vectors.get(allowed_rows)
+            else:
+                vectors = self.index.reconstruct_batch(allowed_rows)
+            found = np.full((len(query_embeddings), depth), -1, dtype="int64")
+            n = min(depth, len(allowed_rows))
+            if n:
+                _, nearest = faiss.knn(np.asarray(query_embeddings, dtype="float32"), vectors, n,
+                                       metric=faiss.METRIC_INNER_PRODUCT)
+                found[:, :n] = allowed_rows[nearest]
+            return found
+        # ...and probe proportionally more lists for larger ones, widening until
+        # every query has its results or all lists have been probed
+        nlist = faiss.extract_index_ivf(self.index).nlist
+        nprobe = min(nlist, int(np.ceil(self.nprobe * self.index.ntotal / n_allowed)))
+        want = min(depth, n_allowed)
+        while True:
+            params = search_params(self.index, selector, nprobe, self.ef_search)
+            found = self.index.search(query_embeddings, depth, params=params)[1]
+            if nprobe >= nlist or (found[:, want - 1] >= 0).all():
+                return found
+            nprobe = min(nlist, nprobe * 2)
+
+    def _rescore(self, query_embeddings, candidates, depth):
+        """Re-rank each query's candidate rows by exact dot product; keeps the top depth."""
+        ranked = np.full((len(candidates), depth), -1, dtype="int64")
+        for i, rows in enumerate(candidates):
+            rows = rows[rows >= 0]
+            if len(rows):
+                scores = self.vectors.get(rows) @ np.asarray(query_embeddings[i], dtype="float32")
+                top = rows[np.argsort(-scores, kind="stable")[:depth]]
+                ranked[i, :len(top)] = top
+        return ranked
+
+    def query(self, query, k=5, allowed_sources=None, mode="dense"):
+        """Top-k chunks for query.
+
+        mode is "dense" (embedding search), "lexical" (BM25 over exact terms)
+        or "hybrid" (reciprocal rank fusion of the two).
+        """
+        return self.query_batch([query], k, allowed_sources, mode)[0]
+
+    def query_batch(self, queries, k=5, allowed_sources=None, mode="dense"):
+        """query() for many queries at once: one encode pass and one index search.
+
+        Returns one result list per query, each filtered to allowed_sources.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        metrics.incr("query.queries", len(queries))
+        if mode != "lexical":
+            with metrics.span("query.encode"):
+                query_embeddings = self.model.encode(queries, batch_size=self.encode_batch_size,
+                                                     normalize_embeddings=True)
+
+        self._reload_if_changed()
+        with self._lock:
+            selector, allowed_rows = None, None
+            if allowed_sources is None and self.dead_rows:
+                allowed_sources = self.source_rows.keys()  # hide rows of deleted sources
+            if allowed_sources is not None:
+                if not any(s in self.source_rows for s in allowed_sources):
+                    return [[] for _ in queries]
+                with metrics.span("query.filter"):
+                    selector, allowed_rows = self._selector(allowed_sources)
+            depth = k * HYBRID_DEPTH if mode == "hybrid" else k
+            dense = None
+            if mode != "lexical":
+                rescore = (self.vectors is not None and is_lossy(self.index)
+                           and len(self.vectors) >= self.index.ntotal)
+                # Filtering happens inside the search, so the full k comes back even
+                # when most sources are unchecked
+                with metrics.span("query.search"):
+                    dense = self._search(query_embeddings, depth * RESCORE_FACTOR if rescore else depth,
+                                         selector, allowed_rows)
+                if rescore:
+                    with metrics.span("query.rescore"):
+                        dense = self._rescore(query_embeddings, dense, depth)
+
+            results = []
+            for i, query in enumerate(queries):
+                rankings = []
+                if dense is not None:
+                    rankings.append(dense[i][dense[i] >= 0])
+                if mode != "dense":
+                    with metrics.span("query.bm25"):
+                        excluded = self._dead if selector is not None and allowed_rows is None else None
+                        rankings.append(self.bm25.search(query, depth, allowed_rows, excluded)[0])
+                rows = rankings[0][:k] if len(rankings) == 1 else reciprocal_rank_fusion(rankings, k)
+                with metrics.span("query.fetch_chunks"):
+                    results.append([self.chunks.get(row) for row in rows])
+            return results
 
 def clean_context(text):
     text = re.sub(r"\[.*?\]", "", text)
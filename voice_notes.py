@@ -0,0 +1,191 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from chunker import get_chunker
+from ingest import chunk_tokenizer
+
+NOTES_SOURCE_ID = "voice-notes"
+NOTES_SOURCE_NAME = "🎙️ Voice Notes"
+DEBOUNCE_SECONDS = 5  # index once notes stop arriving for this long...
+MAX_DELAY_SECONDS = 30  # ...but never hold a note back longer than this
+LEGACY_NOTES_FILE = "notes.md"
+TRANSCRIBER = os.environ.get("VOICE_TRANSCRIBER", "google")
+
+_stores = {}
+_indexers = {}
+_store_lock = threading.Lock()
+
+
+def get_note_store(directory="."):
+    """Notes for the workspace stored in directory (notes.md only feeds the default one)."""
+    with _store_lock:
+        if directory not in _stores:
+            _stores[directory] = NoteStore(os.path.join(directory, "notes.db"))
+            if directory == ".":
+                _stores[directory].import_legacy()
+        return _stores[directory]
+
+
+def get_note_indexer(vs):
+    """The process-wide indexer for vs's workspace, so debouncing spans every session."""
+    store = get_note_store(vs.directory)
+    with _store_lock:
+        if vs.directory not in _indexers:
+            _indexers[vs.directory] = NoteIndexer(vs, store)
+        _indexers[vs.directory].vs = vs  # the store may have been unloaded and loaded again
+        return _indexers[vs.directory]
+
+
+class NoteStore:
+    """Voice notes as SQLite records; `indexed` marks the ones already in the vector store."""
+
+    def __init__(self, path="notes.db"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS notes (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, "
+            "created REAL, transcriber TEXT, indexed INTEGER DEFAULT 0)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS notes_indexed ON notes (indexed)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def add(self, text, transcriber=None, created=None):
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO notes (text, created, transcriber) VALUES (?, ?, ?)",
+                                        (text, created or time.time(), transcriber))
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def recent(self, limit=10):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, text, created, transcriber, indexed FROM notes ORDER BY id DESC LIMIT ?", (limit,))
+            return [dict(zip(("id", "text", "created", "transcriber", "indexed"), row)) for row in rows]
+
+    def unindexed(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, text, created FROM notes WHERE indexed = 0 ORDER BY id")
+            return [dict(zip(("id", "text", "created"), row)) for row in rows]
+
+    def count(self, unindexed_only=False):
+        query = "SELECT COUNT(*) FROM notes" + (" WHERE indexed = 0" if unindexed_only else "")
+        with self._lock:
+            return self._conn.execute(query).fetchone()[0]
+
+    def mark_indexed(self, ids):
+        with self._lock:
+            self._conn.executemany("UPDATE notes SET indexed = 1 WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def import_legacy(self, path=LEGACY_NOTES_FILE):
+        """Import "### Note:" blocks appended to notes.md since the last import."""
+        if not os.path.exists(path):
+            return 0
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (path,)).fetchone()
+        offset = int(row[0]) if row else 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        if not data:
+            return 0
+        created = os.path.getmtime(path)
+        notes = [block.strip() for block in data.decode("utf-8", errors="replace").split("### Note:")]
+        notes = [n for n in notes if n]
+        for text in notes:
+            self.add(text, "legacy", created)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (path, str(offset + len(data))))
+            self._conn.commit()
+        return len(notes)
+
+
+def note_chunks(note, tokenizer=None):
+    """Chunk texts for one note, each labelled with when it was recorded.
+
+    Pass the store's tokenizer (ingest.chunk_tokenizer) to size chunks the
+    way ingestion does; without one, token counts are approximate.
+    """
+    stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(note["created"]))
+    chunks = get_chunker("text", tokenizer).chunks([note["text"]])
+    return [f"Voice note ({stamp}): {chunk}" for chunk in chunks]
+
+
+class NoteIndexer:
+    """Embeds new notes into the vector store as one source, in debounced batches.
+
+    schedule() after saving a note; the batch runs DEBOUNCE_SECONDS after the
+    last call (at most MAX_DELAY_SECONDS after the first), so a burst of notes
+    costs one encode pass and one index append.
+    """
+
+    def __init__(self, vs, store):
+        self.vs = vs
+        self.store = store
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # held while embedding, so schedule() never waits on it
+        self._timer = None
+        self._first = None
+
+    @property
+    def vs(self):
+        # Held weakly so a workspace can be unloaded from memory while it has an indexer
+        return self._vs()
+
+    @vs.setter
+    def vs(self, vs):
+        self._vs = weakref.ref(vs)
+
+    def schedule(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+            self._first = self._first or now
+            delay = max(0.0, min(DEBOUNCE_SECONDS, self._first + MAX_DELAY_SECONDS - now))
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Index every pending note now; returns how many were indexed."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer, self._first = None, None
+        with self._flush_lock:
+            vs = self.vs
+            notes = self.store.unindexed() if vs is not None else []
+            if not notes:
+                return 0  # pending notes of an unloaded workspace are picked up when it loads again
+            tokenizer = chunk_tokenizer(vs)
+            texts = [chunk for note in notes for chunk in note_chunks(note, tokenizer)]
+            vs.add_texts(texts, NOTES_SOURCE_ID)
+            entry = vs.registry.get(NOTES_SOURCE_ID)
+            chunks = (entry["chunks"] if entry else 0) + len(texts)
+            vs.registry.add(NOTES_SOURCE_ID, NOTES_SOURCE_NAME, "note", chunks)
+            self.store.mark_indexed([note["id"] for note in notes])
+            return len(notes)
+
+
+def _recognize_vosk(recognizer, audio):
+    return json.loads(recognizer.recognize_vosk(audio)).get("text", "")
+
+
+# Offline engines ("sphinx" needs pocketsphinx, "vosk" a model in ./model) don't block on the network
+TRANSCRIBERS = {
+    "google": lambda recognizer, audio: recognizer.recognize_google(audio),
+    "sphinx": lambda recognizer, audio: recognizer.recognize_sphinx(audio),
+    "vosk": _recognize_vosk,
+}
+
+
+def transcribe(recognizer, audio, transcriber=None):
+    """Turn recorded audio into text with the chosen engine (VOICE_TRANSCRIBER by default)."""
+    transcriber = transcriber or TRANSCRIBER
+    if transcriber not in TRANSCRIBERS:
+        raise ValueError(f"Unknown transcriber: {transcriber} (choose from {', '.join(TRANSCRIBERS)})")
+    return TRANSCRIBERS[transcriber](recognizer, audio)
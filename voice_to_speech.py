@@ -1,12 +1,8 @@
 import streamlit as st
 import speech_recognition as sr 
+from voice_notes import TRANSCRIBER, TRANSCRIBERS, get_note_store, transcribe
 
-def save_note_to_file(text):
-    """Save the recognized text as a note in a markdown file."""
-    with open("notes.md", "a") as file:
-        file.write(f"### Note:\n{text}\n\n")
-
-def record_note():
+def record_note(transcriber):
     """Record voice, convert it to text and display in the Streamlit interface."""
     recognizer = sr.Recognizer()
     mic = sr.Microphone()
@@ -17,15 +13,17 @@ def record_note():
             recognizer.adjust_for_ambient_noise(source)
             audio = recognizer.listen(source)
 
-            # Use Google's Web Speech API for recognizing speech
-            text = recognizer.recognize_google(audio)
-            st.success(f"Recognized: {text}")
+        text = transcribe(recognizer, audio, transcriber)
+        if not text:
+            st.error("Sorry, I could not understand your speech.")
+            return
+        st.success(f"Recognized: {text}")
 
-            # Display the recognized text in the Streamlit app
-            st.text_area("Your Note", value=text, height=150)
+        # Display the recognized text in the Streamlit app
+        st.text_area("Your Note", value=text, height=150)
 
-            # Save the note to markdown file
-            save_note_to_file(text)
+        # Save the note; the main app indexes it into the knowledge base
+        get_note_store().add(text, transcriber)
 
     except sr.UnknownValueError:
         st.error("Sorry, I could not understand your speech.")
@@ -35,6 +33,12 @@ def record_note():
 # Streamlit interface
 st.title("Voice Notes App")
 st.write("Click the button below and speak to record your note.")
+transcriber = st.selectbox("Transcriber", list(TRANSCRIBERS), index=list(TRANSCRIBERS).index(TRANSCRIBER),
+                           help="sphinx and vosk run offline")
 
 if st.button("Record Note"):
-    record_note()
+    record_note(transcriber)
+
+st.subheader("Recent notes")
+for note in get_note_store().recent(10):
+    st.markdown(f"- {note['text']}")
@@ -0,0 +1,162 @@
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import metrics
+
+DEFAULT_WORKSPACE = "default"  # the store in the working directory, as before workspaces existed
+WORKSPACES_DIR = "workspaces"
+MAX_LOADED = int(os.environ.get("WORKSPACES_MAX_LOADED", 4))  # indexes kept in memory at once
+IDLE_SECONDS = int(os.environ.get("WORKSPACES_IDLE_SECONDS", 30 * 60))  # unload after this long unused
+SWEEP_SECONDS = 60
+NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_workspaces():
+    """The process-wide WorkspaceManager; VECTOR_QUANTIZATION and EMBEDDING_ENCODER configure its stores."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager(quantization=os.environ.get("VECTOR_QUANTIZATION") or None,
+                                        encoder=os.environ.get("EMBEDDING_ENCODER", "torch"))
+            threading.Thread(target=_sweep, args=(_manager,), daemon=True).start()
+        return _manager
+
+
+def _sweep(manager):
+    while True:
+        time.sleep(SWEEP_SECONDS)
+        manager.evict_idle()
+
+
+def workspace_dir(name, root=WORKSPACES_DIR):
+    if name == DEFAULT_WORKSPACE:
+        return "."
+    if not NAME_RE.match(name):
+        raise ValueError(f"Invalid workspace name: {name!r} (letters, digits, - and _ only)")
+    return os.path.join(root, name)
+
+
+class WorkspaceManager:
+    """Named knowledge bases, each a VectorStore in its own directory.
+
+    A workspace's index is loaded on first use and kept in an LRU; past
+    max_loaded stores, or once a store has been idle for idle_seconds, it is
+    dropped from memory (everything is already on disk, so the next use just
+    reloads it; its WAL is folded into the index in the background first).
+    Stores in use by use(), or busy migrating, compacting or rebuilding, are
+    never dropped. The embedding model is shared by all of them.
+    """
+
+    def __init__(self, root=WORKSPACES_DIR, max_loaded=MAX_LOADED, idle_seconds=IDLE_SECONDS, **store_options):
+        self.root = root
+        self.max_loaded = max_loaded
+        self.idle_seconds = idle_seconds
+        self.store_options = store_options  # passed to every VectorStore
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # name -> [store, last used, users], least recently used first
+        self._loading = {}  # name -> Event set once the store being loaded is in _loaded (or failed)
+
+    def list(self):
+        """Names of every workspace on disk, the default one first."""
+        names = sorted(d for d in os.listdir(self.root) if NAME_RE.match(d)) if os.path.isdir(self.root) else []
+        return [DEFAULT_WORKSPACE] + names
+
+    def exists(self, name):
+        if name == DEFAULT_WORKSPACE:
+            return True
+        return bool(NAME_RE.match(name)) and os.path.isdir(workspace_dir(name, self.root))
+
+    def create(self, name):
+        os.makedirs(workspace_dir(name, self.root), exist_ok=True)
+        return name
+
+    def get(self, name=DEFAULT_WORKSPACE, pin=False):
+        """The workspace's store, loading it (and unloading others) if needed.
+
+        Loading happens outside the manager lock, so a big workspace only
+        holds up callers that want that same workspace. pin=True also takes a
+        use() pin in the same step, before the store can be evicted.
+        """
+        from vector_store import VectorStore  # faiss and the model load only once a store is needed
+        while True:
+            with self._lock:
+                entry = self._loaded.get(name)
+                if entry is not None:
+                    entry[1] = time.monotonic()
+                    entry[2] += pin
+                    self._loaded.move_to_end(name)
+                    self._evict(keep=name)
+                    return entry[0]
+                loading = self._loading.get(name)
+                if loading is None:
+                    if not self.exists(name):
+                        raise KeyError(f"No such workspace: {name}")
+                    loading = self._loading[name] = threading.Event()
+                    break
+            loading.wait()  # another caller is loading it; if that failed, try again here
+
+        try:
+            with metrics.span("workspace.load"):
+                store = VectorStore(workspace_dir(name, self.root), **self.store_options)
+            store.warm_up()  # load the (shared) model in the background before the first query
+            with self._lock:
+                self._loaded[name] = [store, time.monotonic(), int(pin)]
+                self._evict(keep=name)
+        finally:
+            with self._lock:
+                del self._loading[name]
+            loading.set()
+        metrics.incr("workspace.loads")
+        return store
+
+    @contextmanager
+    def use(self, name=DEFAULT_WORKSPACE):
+        """get(), pinned in memory until the block exits (e.g. for an ingestion job)."""
+        store = self.get(name, pin=True)
+        try:
+            yield store
+        finally:
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded[name][1] = time.monotonic()
+                    self._loaded[name][2] -= 1
+
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded)
+
+    def _evict(self, keep=None):
+        now = time.monotonic()
+        for name, (store, used, users) in list(self._loaded.items()):
+            over = len(self._loaded) > self.max_loaded
+            if not over and now - used < self.idle_seconds:
+                continue
+            if users or store.busy or name == keep:
+                continue
+            del self._loaded[name]
+            # Fold its WAL now, so reloading it later doesn't replay (and re-tokenize) it
+            threading.Thread(target=store.close, daemon=True).start()
+            metrics.incr("workspace.evictions")
+
+    def evict_idle(self):
+        """Unload every store idle for longer than idle_seconds."""
+        with self._lock:
+            self._evict()
+
+    def delete(self, name):
+        """Remove a workspace and everything in it (not the default one)."""
+        if name == DEFAULT_WORKSPACE:
+            raise ValueError("The default workspace can't be deleted")
+        with self._lock:
+            entry = self._loaded.get(name)
+            if (entry and entry[2]) or name in self._loading:
+                raise RuntimeError(f"Workspace {name} is in use")
+            self._loaded.pop(name, None)
+        shutil.rmtree(workspace_dir(name, self.root), ignore_errors=True)